@@ -0,0 +1,253 @@
+import argparse
+import collections
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from boundaries import DistrictStore
+from genData import DB_CONFIG, DatabaseManager, geofence_geometries
+from geocells import encode as geohash
+from geocoder import ReverseGeocoder
+from geofence_engine import GeofenceEngine
+from partitions import ROLLUP_SQL, ROLLUP_TABLE
+
+# What a backfill can re-derive from a fix's position: state and district (location), the
+# geofence status and the geohash cell. Status is opt-in: it re-evaluates stored fixes against
+# today's geofences, which rewrites the status they were recorded with.
+FIELDS = ('location', 'status', 'cell')
+DEFAULT_FIELDS = ('location', 'cell')
+
+CREATE_CHECKPOINT_SQL = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    name TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL,
+    rows_scanned BIGINT NOT NULL DEFAULT 0,
+    rows_updated BIGINT NOT NULL DEFAULT 0,
+    first_changed TIMESTAMP,
+    last_changed TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+# Written in the same transaction as the corrections it covers, so a resumed run neither skips
+# nor repeats a chunk. first/last_changed bound the fixes whose location changed (for rollups).
+CHECKPOINT_SQL = """
+INSERT INTO backfill_checkpoints (name, last_id, rows_scanned, rows_updated, first_changed, last_changed, updated_at)
+VALUES (%s, %s, %s, %s, %s, %s, now())
+ON CONFLICT (name) DO UPDATE SET
+    last_id = EXCLUDED.last_id,
+    rows_scanned = backfill_checkpoints.rows_scanned + EXCLUDED.rows_scanned,
+    rows_updated = backfill_checkpoints.rows_updated + EXCLUDED.rows_updated,
+    first_changed = LEAST(backfill_checkpoints.first_changed, EXCLUDED.first_changed),
+    last_changed = GREATEST(backfill_checkpoints.last_changed, EXCLUDED.last_changed),
+    updated_at = now()
+"""
+
+SELECT_SQL = """
+SELECT id, timestamp, device_id, latitude, longitude, state, district, status, cell
+FROM terminal_data
+WHERE id > %s {filters}
+ORDER BY id
+"""
+
+# One statement per chunk; (id, timestamp) is the primary key of every partition
+UPDATE_SQL = """
+UPDATE terminal_data AS t
+SET state = v.state, district = v.district, status = v.status, cell = v.cell
+FROM (VALUES %s) AS v(id, timestamp, device_id, state, district, status, cell)
+WHERE t.id = v.id AND t.timestamp = v.timestamp
+"""
+
+# Corrected fixes that are a device's latest position also correct its terminals row; its status
+# is left alone, as it is kept current by geofence events
+UPDATE_TERMINALS_SQL = """
+UPDATE terminals AS t
+SET state = v.state, district = v.district, cell = v.cell
+FROM (VALUES %s) AS v(id, timestamp, device_id, state, district, status, cell)
+WHERE t.device_id = v.device_id AND t.last_timestamp = v.timestamp
+"""
+
+VALUES_TEMPLATE = "(%s, %s::timestamp, %s, %s, %s, %s, %s)"
+
+# Per-process lookups, built by _init_worker
+_geocoder = None
+_engine = None
+
+
+def _init_worker(geojson, geofence_boundaries, geofences, fields):
+    global _geocoder, _engine
+    if 'location' in fields:
+        _geocoder = ReverseGeocoder.from_store(DistrictStore.from_geojson(geojson))
+    if 'status' in fields:
+        _engine = GeofenceEngine()
+        if geofences:
+            _engine.set_geofences(geofence_geometries(geofences, DistrictStore.from_geojson(geofence_boundaries)))
+
+
+# Re-derive `fields` for a chunk of SELECT_SQL rows; returns (UPDATE values for the rows that
+# change, timestamps of the rows whose state or district changed)
+def classify(rows, fields):
+    located = [row for row in rows if row[3] is not None and row[4] is not None]
+    if not located:
+        return [], []
+    locations = _geocoder.lookup_many([r[3] for r in located], [r[4] for r in located]) \
+        if 'location' in fields else None
+    statuses = _engine.resolve_statuses((r[2], r[3], r[4]) for r in located) if 'status' in fields else None
+
+    corrections, relocated = [], []
+    for i, (row_id, timestamp, device_id, latitude, longitude, state, district, status, cell) in enumerate(located):
+        new = (
+            *(locations[i] if locations else (state, district)),
+            statuses[i] if statuses else status,
+            geohash(latitude, longitude) if 'cell' in fields else cell,
+        )
+        if new != (state, district, status, cell):
+            corrections.append((row_id, timestamp, device_id, *new))
+            if new[:2] != (state, district):
+                relocated.append(timestamp)
+    return corrections, relocated
+
+
+# Re-run the hourly rollups over [since, until], a day at a time, but only over hours that
+# have already been rolled up; later hours are picked up by partition maintenance as usual
+def refresh_rollups(db_manager, since, until):
+    with db_manager.connection.cursor() as cursor:
+        cursor.execute(f"SELECT max(hour) FROM {ROLLUP_TABLE}")
+        rolled_up = cursor.fetchone()[0]
+    if rolled_up is None:
+        return
+    start = since.replace(minute=0, second=0, microsecond=0)
+    end = min(until.replace(minute=0, second=0, microsecond=0), rolled_up) + timedelta(hours=1)
+    while start < end:
+        step_end = min(start + timedelta(days=1), end)
+        with db_manager.connection.cursor() as cursor:
+            cursor.execute(ROLLUP_SQL.format(table='terminal_data'), (start, step_end))
+        db_manager.commit()
+        start = step_end
+
+
+# Stream terminal_data in id order through a server-side cursor, classify chunks in a process
+# pool and write corrections back in id order, each chunk in one transaction with its checkpoint
+def run(args):
+    fields = sorted(set(args.fields))
+    name = args.name or f"{'+'.join(fields)}:{os.path.basename(args.geojson)}"
+
+    writer = DatabaseManager(DB_CONFIG)
+    writer.connect()  # also brings the terminal_data schema up to date (cell, dictionary codes)
+    reader = psycopg2.connect(**DB_CONFIG)
+    try:
+        with writer.connection.cursor() as cursor:
+            cursor.execute(CREATE_CHECKPOINT_SQL)
+            if args.restart:
+                cursor.execute("DELETE FROM backfill_checkpoints WHERE name = %s", (name,))
+            cursor.execute("SELECT last_id, rows_scanned, rows_updated FROM backfill_checkpoints WHERE name = %s", (name,))
+            last_id, scanned_before, updated_before = cursor.fetchone() or (args.from_id - 1, 0, 0)
+        writer.commit()
+        if scanned_before:
+            print(f"Resuming backfill {name!r} after id {last_id} ({scanned_before} rows scanned, {updated_before} corrected)")
+
+        geofences = writer.fetch_geofences() if 'status' in fields else []
+        filters, params = [], [last_id]
+        for clause, value in (('id <= %s', args.to_id), ('timestamp >= %s', args.since), ('timestamp < %s', args.until)):
+            if value is not None:
+                filters.append(f"AND {clause}")
+                params.append(value)
+
+        source = reader.cursor(name='terminal_data_backfill')
+        source.itersize = args.chunk_size
+        source.execute(SELECT_SQL.format(filters=' '.join(filters)), params)
+
+        started = time.monotonic()
+        totals = {'scanned': 0, 'updated': 0}
+        last_report = [started, 0]
+
+        def write(result, chunk_last_id, chunk_rows):
+            corrections, changed = result.get()
+            with writer.connection.cursor() as cursor:
+                if corrections:
+                    execute_values(cursor, UPDATE_SQL, corrections, template=VALUES_TEMPLATE, page_size=len(corrections))
+                    execute_values(cursor, UPDATE_TERMINALS_SQL, corrections, template=VALUES_TEMPLATE,
+                                   page_size=len(corrections))
+                cursor.execute(CHECKPOINT_SQL, (
+                    name, chunk_last_id, chunk_rows, len(corrections),
+                    min(changed) if changed else None, max(changed) if changed else None,
+                ))
+            writer.commit()
+            totals['scanned'] += chunk_rows
+            totals['updated'] += len(corrections)
+
+            now = time.monotonic()
+            if now - last_report[0] >= args.report_interval:
+                current = (totals['scanned'] - last_report[1]) / (now - last_report[0])
+                last_report[:] = [now, totals['scanned']]
+                print(f"Backfilled up to id {chunk_last_id}: {totals['scanned']} rows scanned, "
+                      f"{totals['updated']} corrected ({current:.1f} rows/s now, "
+                      f"{totals['scanned'] / (now - started):.1f} rows/s overall)")
+
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(args.workers, initializer=_init_worker,
+                          initargs=(args.geojson, args.geofence_boundaries, geofences, fields)) as pool:
+            pending = collections.deque()
+            while True:
+                rows = source.fetchmany(args.chunk_size)
+                if not rows:
+                    break
+                pending.append((pool.apply_async(classify, (rows, fields)), rows[-1][0], len(rows)))
+                # Keep every worker busy, but never hold more than two chunks per worker in memory
+                while pending and (len(pending) >= 2 * args.workers or pending[0][0].ready()):
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+        source.close()
+        reader.commit()
+
+        elapsed = time.monotonic() - started
+        print(f"Backfill {name!r} done: {totals['scanned']} rows scanned, {totals['updated']} corrected "
+              f"in {elapsed:.1f}s ({totals['scanned'] / elapsed if elapsed else 0.0:.1f} rows/s)")
+
+        if 'location' in fields and not args.skip_rollups:
+            with writer.connection.cursor() as cursor:
+                cursor.execute("SELECT first_changed, last_changed FROM backfill_checkpoints WHERE name = %s", (name,))
+                first_changed, last_changed = cursor.fetchone()
+            writer.commit()
+            if first_changed is not None:
+                print(f"Refreshing {ROLLUP_TABLE} from {first_changed} to {last_changed}")
+                refresh_rollups(writer, first_changed, last_changed)
+    finally:
+        reader.close()
+        writer.close()
+
+
+# Re-geocode and re-evaluate stored fixes after a boundary file or the geofences changed, e.g.
+#   python backfill.py --geojson india_taluk.geojson --fields location --workers 8
+# Progress is checkpointed per --name; running the same command again resumes where it stopped.
+def main():
+    parser = argparse.ArgumentParser(description='Recompute state, district, status and cell of stored terminal_data rows')
+    parser.add_argument('--fields', nargs='+', choices=FIELDS, default=list(DEFAULT_FIELDS),
+                        help='What to recompute (status only when asked for)')
+    parser.add_argument('--geojson', default='india_taluk.geojson', help='Boundary file used to geocode fixes')
+    parser.add_argument('--geofence-boundaries', default='india_districts.geojson',
+                        help='District boundaries the geofences table refers to (status)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Classifier processes')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Rows per chunk (fetch, classify and UPDATE)')
+    parser.add_argument('--from-id', type=int, default=1, help='First terminal_data id to process')
+    parser.add_argument('--to-id', type=int, help='Last terminal_data id to process')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='Only fixes at or after this time')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='Only fixes before this time')
+    parser.add_argument('--name', help='Checkpoint name (default: derived from --fields and --geojson)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from --from-id')
+    parser.add_argument('--skip-rollups', action='store_true', help='Do not refresh the hourly rollups afterwards')
+    parser.add_argument('--report-interval', type=float, default=10.0, help='Seconds between progress reports')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
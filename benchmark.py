@@ -0,0 +1,328 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Area covered by the synthetic boundaries (roughly India's bounding box)
+MIN_LAT, MAX_LAT, MIN_LON, MAX_LON = 6.0, 38.0, 66.0, 98.0
+
+
+# Stand-in for paho's publish result: every message counts as delivered immediately
+class FakeMessageInfo:
+    rc = 0
+    mid = 0
+
+    def is_published(self):
+        return True
+
+    def wait_for_publish(self, timeout=None):
+        return True
+
+
+# Stand-in for paho.mqtt.client.Client that records publishes instead of talking to a broker
+class FakeMqttClient:
+    def __init__(self, *args, **kwargs):
+        self.published = 0
+
+    def connect(self, *args, **kwargs):
+        return 0
+
+    def loop_start(self):
+        return 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+        return FakeMessageInfo()
+
+
+# Stand-in for tile38_geofences.Tile38Geofences that records the batches app.py sends
+class FakeTile38:
+    def __init__(self, *args, **kwargs):
+        self.commands = []
+
+    def put_many(self, fences):
+        self.commands.append(('SET_BATCH', len(list(fences))))
+        return []
+
+    def delete_many(self, areas):
+        self.commands.append(('DEL_BATCH', len(list(areas))))
+        return []
+
+    def reconcile(self, areas, geojson):
+        self.commands.append(('RECONCILE', len(areas)))
+        return {'added': [], 'removed_objects': [], 'removed_hooks': [], 'errors': 0}
+
+
+# GeoJSON grid of `states` x `states` states, each split into `districts` x `districts` districts
+def synthetic_boundaries(states=6, districts=2):
+    state_lat = (MAX_LAT - MIN_LAT) / states
+    state_lon = (MAX_LON - MIN_LON) / states
+    features = []
+    for row in range(states):
+        for col in range(states):
+            for d_row in range(districts):
+                for d_col in range(districts):
+                    south = MIN_LAT + row * state_lat + d_row * state_lat / districts
+                    west = MIN_LON + col * state_lon + d_col * state_lon / districts
+                    north, east = south + state_lat / districts, west + state_lon / districts
+                    features.append({
+                        'type': 'Feature',
+                        'properties': {
+                            'NAME_1': f"State {row * states + col + 1}",
+                            'NAME_2': f"District {row * states + col + 1}-{d_row * districts + d_col + 1}",
+                        },
+                        'geometry': {
+                            'type': 'Polygon',
+                            'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+                        },
+                    })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# Replace the MQTT and Tile38 clients before app.py creates them at import time
+def install_fakes():
+    import paho.mqtt.client
+    import tile38_geofences
+    paho.mqtt.client.Client = FakeMqttClient
+    tile38_geofences.Tile38Geofences = FakeTile38
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0] * 1000, 3),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)] * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+
+# Time `call` `repeat` times after one warm-up run; `call` returns the response size (or None)
+def measure(call, repeat):
+    size = call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = call()
+        samples.append(time.perf_counter() - started)
+    result = summarize(samples)
+    if size is not None:
+        result['response_bytes'] = size
+    return result
+
+
+def wait_for_job(fanout, job_id):
+    job = fanout.get(job_id)
+    while job.status in ('queued', 'running'):
+        time.sleep(0.0005)
+    return job
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Seed `devices` x `fixes` rows in the TerminalDataGenerator record shape, one tick every
+# `interval` seconds ending now, plus the latest-position table
+def seed(app_module, generator, fixes, interval, database_uri):
+    from genData import TERMINAL_DATA_COLUMNS
+    now = datetime.utcnow()
+    ticks = []
+    for tick in range(fixes):
+        timestamp = (now - timedelta(seconds=interval * (fixes - 1 - tick))).strftime('%Y-%m-%d %H:%M:%S')
+        ticks.append([(timestamp,) + record[1:] for record in generator.generate_data()])
+
+    if database_uri.startswith('postgresql'):
+        from genData import DatabaseManager
+        manager = DatabaseManager({'dsn': database_uri})
+        manager.connect()
+        try:
+            for records in ticks:
+                manager.copy_rows(records)
+                manager.upsert_latest_positions(records)
+            manager.commit()
+        finally:
+            manager.close()
+        return
+
+    db, TerminalData, Terminal = app_module.db, app_module.TerminalData, app_module.Terminal
+    columns = [c for c in TERMINAL_DATA_COLUMNS if c in TerminalData.__table__.columns]
+    index = {name: TERMINAL_DATA_COLUMNS.index(name) for name in columns}
+    latest = {}
+    for records in ticks:
+        rows = []
+        for record in records:
+            row = {name: record[i] for name, i in index.items()}
+            row['timestamp'] = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
+            rows.append(row)
+            latest[row['device_id']] = row
+        db.session.execute(TerminalData.__table__.insert(), rows)
+    db.session.execute(Terminal.__table__.insert(), [{
+        'device_id': row['device_id'], 'name': row['device_id'], 'sai': row['sai'],
+        'last_latitude': row['latitude'], 'last_longitude': row['longitude'], 'last_timestamp': row['timestamp'],
+        'district': row['district'], 'state': row['state'], 'status': row['status'], 'cell': row['cell'],
+    } for row in latest.values()])
+    db.session.commit()
+
+
+def run(args):
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='geofence-bench-')
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    # app.py reads its boundaries from the working directory
+    boundaries_path = os.path.join(workdir, 'india_districts.geojson')
+    if args.boundaries:
+        os.symlink(os.path.abspath(args.boundaries), boundaries_path)
+    else:
+        with open(boundaries_path, 'w') as f:
+            json.dump(synthetic_boundaries(), f)
+    os.chdir(workdir)
+    os.environ['DATABASE_URI'] = database_uri
+    os.environ['WEBHOOK_QUEUE_PATH'] = os.path.join(workdir, 'webhook_queue.db')
+    os.environ.setdefault('MQTT_FANOUT_RATE', '0')
+    os.environ.setdefault('BOUNDARY_CACHE_DIR', workdir)
+    os.environ['TILE38_RECONCILE_ON_START'] = '0'
+
+    install_fakes()
+    sys.path.insert(0, REPO_DIR)
+    import app as app_module
+    from genData import TerminalDataGenerator
+    from geofence_engine import GeofenceEngine
+
+    results = {}
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        generator = TerminalDataGenerator(None, boundaries_path, num_terminals=args.devices, status_resolver=GeofenceEngine())
+        started = time.perf_counter()
+        seed(app_module, generator, args.fixes, args.interval, database_uri)
+        results['seed'] = {'rows': args.devices * args.fixes, 'seconds': round(time.perf_counter() - started, 3)}
+
+        client = app_module.app.test_client()
+        device_id = generator.device_id_start + '0'
+        timeframe = math.ceil(args.fixes * args.interval / 3600) + 1
+        Terminal = app_module.Terminal
+        busiest = app_module.db.session.query(
+            Terminal.state, Terminal.district, app_module.db.func.count()
+        ).group_by(Terminal.state, Terminal.district).order_by(app_module.db.func.count().desc()).first()
+        state, district = busiest[0], busiest[1]
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return len(response.get_data())
+
+        def post(url, body):
+            response = client.post(url, json=body)
+            assert response.status_code < 300, (url, response.status_code)
+            return len(response.get_data())
+
+        results['latest_terminal_data'] = measure(lambda: get('/api/latest-terminal-data'), args.repeat)
+        results['terminals_in_geofence'] = measure(
+            lambda: post('/api/terminals-in-geofence', {'state': state, 'district': district}), args.repeat)
+        results['path_full'] = measure(lambda: get(f'/api/path?terminal={device_id}&timeframe={timeframe}'), args.repeat)
+        results['path_zoom_10'] = measure(
+            lambda: get(f'/api/path?terminal={device_id}&timeframe={timeframe}&zoom=10'), args.repeat)
+        results['terminal_data_first_page'] = measure(
+            lambda: get(f'/api/terminal-data?terminal={device_id}&timeframe={timeframe}'), args.repeat)
+
+        # Cost of a page deep into the history, reached through the cursor chain
+        cursor, depth = None, 0
+        while depth < args.page_depth:
+            page = client.get(f'/api/terminal-data?terminal={device_id}&timeframe={timeframe}&per_page={args.page_size}'
+                              + (f'&cursor={cursor}' if cursor else '')).get_json()
+            if not page.get('next_cursor'):
+                break
+            cursor, depth = page['next_cursor'], depth + 1
+        results['terminal_data_deep_page'] = dict(measure(
+            lambda: get(f'/api/terminal-data?terminal={device_id}&timeframe={timeframe}&per_page={args.page_size}'
+                        + (f'&cursor={cursor}' if cursor else '')), args.repeat), page=depth + 1, page_size=args.page_size)
+        results['clusters_country'] = measure(
+            lambda: get(f'/api/clusters?bbox={MIN_LON},{MIN_LAT},{MAX_LON},{MAX_LAT}&zoom=5'), args.repeat)
+        viewport = (f'{(MIN_LON + MAX_LON) / 2 - 1},{(MIN_LAT + MAX_LAT) / 2 - 1},'
+                    f'{(MIN_LON + MAX_LON) / 2 + 1},{(MIN_LAT + MAX_LAT) / 2 + 1}')
+        results['terminals_in_bbox'] = measure(lambda: get(f'/api/terminals-in-bbox?bbox={viewport}'), args.repeat)
+        results['occupancy'] = measure(lambda: get('/api/occupancy'), args.repeat)
+
+        # set_geofence request latency, and time until its fan-out job has published everything
+        request_times, fanout_times, fanned_out = [], [], 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.post('/api/set_geofence', json={'state': state, 'district': district}).get_json()
+            request_times.append(time.perf_counter() - started)
+            job = wait_for_job(app_module.get_fanout(), response['job_id'])
+            fanout_times.append(time.perf_counter() - started)
+            fanned_out = len(job.device_ids)
+            removal = client.post('/api/remove_geofence', json={'state': state, 'district': district}).get_json()
+            wait_for_job(app_module.get_fanout(), removal['job_id'])
+        results['set_geofence_request'] = summarize(request_times)
+        results['set_geofence_fanout'] = dict(summarize(fanout_times), devices=fanned_out)
+
+        # Reverse geocoding: one batch call per tick, and single lookups
+        geocoder = app_module.get_geocoder()
+        lats = [random.uniform(MIN_LAT, MAX_LAT) for _ in range(args.devices)]
+        lons = [random.uniform(MIN_LON, MAX_LON) for _ in range(args.devices)]
+        results['geocode_batch'] = dict(measure(lambda: geocoder.lookup_many(lats, lons) and None, args.repeat), points=args.devices)
+        results['geocode_single'] = measure(lambda: geocoder.lookup(lats[0], lons[0]) and None, args.repeat)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': database_uri.split(':', 1)[0],
+            'devices': args.devices,
+            'fixes': args.fixes,
+            'interval': args.interval,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+# Benchmark the app's hot paths against a seeded synthetic fleet, e.g.
+#   python benchmark.py --devices 5000 --fixes 100 --output bench-$(git rev-parse --short HEAD).json
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark app.py hot paths against a synthetic fleet')
+    parser.add_argument('--devices', type=int, default=1000, help='Number of simulated terminals')
+    parser.add_argument('--fixes', type=int, default=100, help='Fixes per terminal')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between fixes of a terminal')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per benchmark')
+    parser.add_argument('--page-depth', type=int, default=20, help='Page reached for the deep-page benchmark')
+    parser.add_argument('--page-size', type=int, default=10, help='Rows per page for the deep-page benchmark')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic fleet')
+    parser.add_argument('--database-uri', help='SQLAlchemy URI of an empty database (default: a temporary SQLite file)')
+    parser.add_argument('--boundaries', help='District GeoJSON to use instead of the synthetic grid')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
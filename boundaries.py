@@ -0,0 +1,91 @@
+import json
+
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+from boundary_cache import BoundaryCache
+
+
+# Boundary of a single district. Bounds are known up front; the geometry is decoded from the
+# compiled cache (and prepared) on first use; the GeoJSON string is serialized once from it.
+class DistrictGeometry:
+    __slots__ = ('state', 'district', 'bounds', '_loader', '_geometry', '_prepared', '_geojson')
+
+    def __init__(self, state, district, geometry=None, bounds=None, loader=None):
+        self.state = state
+        self.district = district
+        self.bounds = tuple(bounds) if bounds is not None else geometry.bounds  # (min_lon, min_lat, max_lon, max_lat)
+        self._loader = loader
+        self._geometry = geometry
+        if geometry is not None:
+            shapely.prepare(geometry)
+        self._prepared = None
+        self._geojson = None
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            self._geometry = self._loader()
+            self._loader = None
+            shapely.prepare(self._geometry)
+        return self._geometry
+
+    @property
+    def prepared(self):
+        if self._prepared is None:
+            self._prepared = prep(self.geometry)
+        return self._prepared
+
+    @property
+    def geojson(self):
+        if self._geojson is None:
+            self._geojson = json.dumps(mapping(self.geometry))
+        return self._geojson
+
+    def __repr__(self):
+        return f'<DistrictGeometry {self.state}, {self.district}>'
+
+
+# District boundaries keyed by (state, district)
+class DistrictStore:
+    def __init__(self, entries):
+        self.entries = {(e.state, e.district): e for e in entries}
+        self.states_and_districts = {}
+        for state, district in self.entries:
+            self.states_and_districts.setdefault(state, []).append(district)
+
+    @classmethod
+    def from_features(cls, features, state_key='NAME_1', district_key='NAME_2'):
+        geometries = {}
+        for feature in features:
+            key = (feature['properties'][state_key], feature['properties'][district_key])
+            geometries.setdefault(key, []).append(shape(feature['geometry']))
+
+        # Districts split across several features are merged into one shape
+        return cls(
+            DistrictGeometry(state, district, parts[0] if len(parts) == 1 else unary_union(parts))
+            for (state, district), parts in geometries.items()
+        )
+
+    @classmethod
+    def from_cache(cls, cache):
+        return cls(
+            DistrictGeometry(state, district, bounds=bounds, loader=lambda i=i: cache.decode(i))
+            for i, (state, district, _, _, *bounds) in enumerate(cache.entries)
+        )
+
+    # Load through the compiled boundary cache, (re)compiling it if the GeoJSON has changed
+    @classmethod
+    def from_geojson(cls, file_path, **kwargs):
+        return cls.from_cache(BoundaryCache.load_or_compile(file_path, **kwargs))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def get(self, state, district):
+        return self.entries.get((state, district))
@@ -0,0 +1,126 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+import shapely
+from shapely.geometry import shape
+from shapely.ops import unary_union
+
+# Compiled boundary cache
+#
+# Layout: MAGIC | u32 header length | JSON header | WKB blobs
+# The header records the source file's size and mtime (used to detect a stale cache) and,
+# per district, (state, district, offset, length, min_lon, min_lat, max_lon, max_lat).
+# Offsets are relative to the first blob. Workers mmap the file, so the blobs live in the
+# shared page cache and each geometry is only decoded when first asked for.
+MAGIC = b'GEOFBC01'
+HEADER_LEN = struct.Struct('<I')
+CACHE_SUFFIX = '.boundaries.bin'
+
+
+def cache_path_for(geojson_path):
+    cache_dir = os.getenv('BOUNDARY_CACHE_DIR')
+    base = os.path.splitext(os.path.basename(geojson_path))[0] + CACHE_SUFFIX
+    if cache_dir:
+        return os.path.join(cache_dir, base)
+    return os.path.join(os.path.dirname(os.path.abspath(geojson_path)), base)
+
+
+def _source_fingerprint(geojson_path):
+    st = os.stat(geojson_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+# Parse the GeoJSON once and write the binary cache next to it (or to BOUNDARY_CACHE_DIR)
+def compile_cache(geojson_path, cache_path=None, state_key='NAME_1', district_key='NAME_2'):
+    cache_path = cache_path or cache_path_for(geojson_path)
+    fingerprint = _source_fingerprint(geojson_path)
+    with open(geojson_path) as f:
+        features = json.load(f)['features']
+
+    # Districts split across several features are merged into one shape
+    parts = {}
+    for feature in features:
+        key = (feature['properties'][state_key], feature['properties'][district_key])
+        parts.setdefault(key, []).append(shape(feature['geometry']))
+
+    entries = []
+    blobs = []
+    offset = 0
+    for (state, district), geometries in parts.items():
+        geometry = geometries[0] if len(geometries) == 1 else unary_union(geometries)
+        blob = shapely.to_wkb(geometry)
+        entries.append([state, district, offset, len(blob), *geometry.bounds])
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = json.dumps({
+        'source': fingerprint,
+        'state_key': state_key,
+        'district_key': district_key,
+        'entries': entries,
+    }).encode('utf-8')
+
+    # Write to a temporary file and rename, so concurrently starting workers never see a partial cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+# Read-only view over a compiled cache file
+class BoundaryCache:
+    def __init__(self, cache_path):
+        self.path = cache_path
+        with open(cache_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f'{cache_path} is not a boundary cache')
+
+        (header_len,) = HEADER_LEN.unpack_from(self._mm, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LEN.size
+        header = json.loads(self._mm[header_start:header_start + header_len])
+        self.source = header['source']
+        self.state_key = header['state_key']
+        self.district_key = header['district_key']
+        self.entries = header['entries']
+        self._data_start = header_start + header_len
+
+    @classmethod
+    def load_or_compile(cls, geojson_path, cache_path=None, state_key='NAME_1', district_key='NAME_2'):
+        cache_path = cache_path or cache_path_for(geojson_path)
+        try:
+            cache = cls(cache_path)
+            if (cache.source == _source_fingerprint(geojson_path)
+                    and (cache.state_key, cache.district_key) == (state_key, district_key)):
+                return cache
+            cache.close()
+        except (OSError, ValueError):
+            pass
+        compile_cache(geojson_path, cache_path, state_key, district_key)
+        return cls(cache_path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def decode(self, index):
+        _, _, offset, length = self.entries[index][:4]
+        start = self._data_start + offset
+        return shapely.from_wkb(self._mm[start:start + length])
+
+    def close(self):
+        self._mm.close()
+
+
+if __name__ == '__main__':
+    # Usage: python boundary_cache.py india_districts.geojson india_taluk.geojson
+    for path in sys.argv[1:] or ['india_districts.geojson', 'india_taluk.geojson']:
+        print(f"Compiled {path} -> {compile_cache(path)}")
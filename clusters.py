@@ -0,0 +1,238 @@
+import math
+import threading
+from collections import defaultdict
+
+# Zoom level from which individual terminals are returned instead of clusters
+POINT_ZOOM = 13
+
+# Cap on grid cells enumerated for one request; wider areas fall back to scanning occupied cells
+MAX_ENUMERATED_CELLS = 4096
+
+
+def is_active(status):
+    return (status or 'active').lower() == 'active'
+
+
+# Grid cell size (degrees) for a zoom level: `cell_px` screen pixels on a 256px web-mercator tile
+def cell_size(level, cell_px=64):
+    return 360.0 / 2 ** level * cell_px / 256
+
+
+# Running totals of the terminals in one grid cell, overall and per (state, district)
+class _Cell:
+    __slots__ = ('count', 'active', 'lat_sum', 'lon_sum', 'parts')
+
+    def __init__(self):
+        self.count = 0
+        self.active = 0
+        self.lat_sum = 0.0
+        self.lon_sum = 0.0
+        self.parts = {}
+
+    def add(self, sign, latitude, longitude, active, area):
+        self.count += sign
+        self.active += sign * active
+        self.lat_sum += sign * latitude
+        self.lon_sum += sign * longitude
+        part = self.parts.get(area)
+        if part is None:
+            part = self.parts[area] = [0, 0, 0.0, 0.0]
+        part[0] += sign
+        part[1] += sign * active
+        part[2] += sign * latitude
+        part[3] += sign * longitude
+        if not part[0]:
+            del self.parts[area]
+
+    # A terminal moved within the cell without changing area or status
+    def shift(self, d_lat, d_lon, area):
+        self.lat_sum += d_lat
+        self.lon_sum += d_lon
+        part = self.parts[area]
+        part[2] += d_lat
+        part[3] += d_lon
+
+    # (count, active, lat_sum, lon_sum), optionally restricted to a state or a district
+    def totals(self, state=None, district=None):
+        if state is None:
+            return self.count, self.active, self.lat_sum, self.lon_sum
+        count = active = 0
+        lat_sum = lon_sum = 0.0
+        for (part_state, part_district), part in self.parts.items():
+            if part_state == state and (district is None or part_district == district):
+                count += part[0]
+                active += part[1]
+                lat_sum += part[2]
+                lon_sum += part[3]
+        return count, active, lat_sum, lon_sum
+
+
+# In-memory index of the latest terminal positions for map clustering.
+#
+# Every terminal is counted in one grid cell per zoom level 0..POINT_ZOOM, and the cells keep
+# running totals (count, active count, coordinate sums for the centroid), so moving a terminal
+# costs O(levels) and a cluster request only touches the grid cells inside the viewport, no
+# matter how large the fleet is. At POINT_ZOOM and above the finest level also keeps the device
+# ids of each cell, so individual terminals can be listed for the viewport.
+class FleetIndex:
+    def __init__(self, point_zoom=POINT_ZOOM, cell_px=64):
+        self.point_zoom = point_zoom
+        self.cell_px = cell_px
+        self._sizes = [cell_size(level, cell_px) for level in range(point_zoom + 1)]
+        self._inverse = [1.0 / size for size in self._sizes]
+        self._levels = [{} for _ in self._sizes]  # level -> {(ix, iy): _Cell}
+        self._members = defaultdict(set)  # finest-level cell -> device ids
+        self._devices = {}  # device_id -> dict(latitude, longitude, status, state, district)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def _cell(self, level, latitude, longitude):
+        inverse = self._inverse[level]
+        return math.floor(longitude * inverse), math.floor(latitude * inverse)
+
+    @staticmethod
+    def _located(device):
+        return device is not None and device['latitude'] is not None and device['longitude'] is not None
+
+    # Move a device's contribution from `previous` to `device` (either may be None / unlocated).
+    # Coarse cells usually stay the same for a move, so those are only shifted in place.
+    def _move(self, device_id, previous, device):
+        old = self._located(previous)
+        new = self._located(device)
+        if old:
+            old_lat, old_lon = previous['latitude'], previous['longitude']
+            old_area = (previous['state'], previous['district'])
+            old_active = 1 if is_active(previous['status']) else 0
+        if new:
+            lat, lon = device['latitude'], device['longitude']
+            area = (device['state'], device['district'])
+            active = 1 if is_active(device['status']) else 0
+        same_kind = old and new and old_area == area and old_active == active
+
+        for cells, inverse in zip(self._levels, self._inverse):
+            old_key = (math.floor(old_lon * inverse), math.floor(old_lat * inverse)) if old else None
+            new_key = (math.floor(lon * inverse), math.floor(lat * inverse)) if new else None
+            if same_kind and old_key == new_key:
+                cells[new_key].shift(lat - old_lat, lon - old_lon, area)
+                continue
+            if old:
+                cell = cells[old_key]
+                cell.add(-1, old_lat, old_lon, old_active, old_area)
+                if not cell.count:
+                    del cells[old_key]
+            if new:
+                cell = cells.get(new_key)
+                if cell is None:
+                    cell = cells[new_key] = _Cell()
+                cell.add(1, lat, lon, active, area)
+
+        # old_key / new_key now hold the finest-level cells
+        if old_key != new_key:
+            if old:
+                members = self._members[old_key]
+                members.discard(device_id)
+                if not members:
+                    del self._members[old_key]
+            if new:
+                self._members[new_key].add(device_id)
+
+    # Merge a change for one device; fields left out (or None) keep their previous value
+    def update(self, device_id, latitude=None, longitude=None, status=None, state=None, district=None, **_):
+        with self._lock:
+            previous = self._devices.get(device_id)
+            device = dict(previous) if previous else {
+                'latitude': None, 'longitude': None, 'status': None, 'state': None, 'district': None
+            }
+            for key, value in (('latitude', latitude), ('longitude', longitude), ('status', status),
+                               ('state', state), ('district', district)):
+                if value is not None:
+                    device[key] = value
+            if device == previous:
+                return
+            self._move(device_id, previous, device)
+            self._devices[device_id] = device
+
+    def remove(self, device_id):
+        with self._lock:
+            previous = self._devices.pop(device_id, None)
+            if previous:
+                self._move(device_id, previous, None)
+
+    # Occupied cells of `level` intersecting the bbox
+    def _cells_in(self, cells, level, min_lon, min_lat, max_lon, max_lat):
+        min_x, min_y = self._cell(level, min_lat, min_lon)
+        max_x, max_y = self._cell(level, max_lat, max_lon)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= min(MAX_ENUMERATED_CELLS, len(cells)):
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    if (x, y) in cells:
+                        yield (x, y), cells[(x, y)]
+        else:
+            for (x, y), cell in list(cells.items()):
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    yield (x, y), cell
+
+    # Clusters (or individual terminals at point zoom) for a viewport, optionally restricted to
+    # a state or a district
+    def query(self, min_lon, min_lat, max_lon, max_lat, zoom, state=None, district=None, limit=5000):
+        zoom = max(0, int(zoom))
+        with self._lock:
+            if zoom >= self.point_zoom:
+                return self._points(min_lon, min_lat, max_lon, max_lat, state, district, limit)
+            return self._clusters(min_lon, min_lat, max_lon, max_lat, zoom, state, district)
+
+    def _clusters(self, min_lon, min_lat, max_lon, max_lat, level, state, district):
+        size = self._sizes[level]
+        clusters = []
+        total = active_total = 0
+        for (x, y), cell in self._cells_in(self._levels[level], level, min_lon, min_lat, max_lon, max_lat):
+            count, active, lat_sum, lon_sum = cell.totals(state, district)
+            if not count:
+                continue
+            clusters.append({
+                'latitude': lat_sum / count,
+                'longitude': lon_sum / count,
+                'count': count,
+                'active': active,
+                'inactive': count - active,
+                'bounds': [x * size, y * size, (x + 1) * size, (y + 1) * size],
+            })
+            total += count
+            active_total += active
+        return {
+            'mode': 'clusters',
+            'zoom': level,
+            'total': total,
+            'active': active_total,
+            'inactive': total - active_total,
+            'clusters': clusters,
+        }
+
+    def _points(self, min_lon, min_lat, max_lon, max_lat, state, district, limit):
+        points = []
+        truncated = False
+        for _, device_ids in self._cells_in(self._members, self.point_zoom, min_lon, min_lat, max_lon, max_lat):
+            for device_id in device_ids:
+                device = self._devices[device_id]
+                if not (min_lon <= device['longitude'] <= max_lon and min_lat <= device['latitude'] <= max_lat):
+                    continue
+                if (state and device['state'] != state) or (district and device['district'] != district):
+                    continue
+                if len(points) >= limit:
+                    truncated = True
+                    break
+                points.append(dict(device, device_id=device_id, active=is_active(device['status'])))
+            if truncated:
+                break
+        active_total = sum(1 for p in points if p['active'])
+        return {
+            'mode': 'points',
+            'zoom': self.point_zoom,
+            'total': len(points),
+            'active': active_total,
+            'inactive': len(points) - active_total,
+            'truncated': truncated,
+            'points': points,
+        }
@@ -0,0 +1,118 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from redis import Redis
+
+# Redis server shared by all workers: Socket.IO message queue, live-update subscriptions and
+# leader leases. Unset means a single worker, where every lease is granted locally.
+MESSAGE_QUEUE_URL = os.getenv('MESSAGE_QUEUE_URL') or None
+
+_RENEW = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end
+return 0
+"""
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+def node_name():
+    return socket.gethostname()
+
+
+def worker_name():
+    return f"{node_name()}:{os.getpid()}"
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# One client (connection pool) per URL and process
+def shared_client(url=MESSAGE_QUEUE_URL):
+    with _clients_lock:
+        client = _clients.get((url, os.getpid()))
+        if client is None:
+            client = _clients[(url, os.getpid())] = Redis.from_url(
+                url, decode_responses=True, socket_timeout=5.0, socket_connect_timeout=5.0
+            )
+        return client
+
+
+# Named lock held by one worker at a time, expiring after `ttl` seconds unless renewed, so a
+# worker that dies loses it. acquire() both takes a free lease and renews one already held.
+class LeaderLease:
+    def __init__(self, name, url=MESSAGE_QUEUE_URL, ttl=15.0):
+        self.key = f"leader:{name}"
+        self.url = url
+        self.ttl = ttl
+        self.owner = f"{worker_name()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        if not self.url:
+            return True
+        client = shared_client(self.url)
+        ttl_ms = int(self.ttl * 1000)
+        if client.set(self.key, self.owner, nx=True, px=ttl_ms):
+            return True
+        return bool(client.eval(_RENEW, 1, self.key, self.owner, ttl_ms))
+
+    def release(self):
+        if self.url:
+            shared_client(self.url).eval(_RELEASE, 1, self.key, self.owner)
+
+    def holder(self):
+        return shared_client(self.url).get(self.key) if self.url else self.owner
+
+
+# Keeps trying to hold a lease and runs on_elected() when this worker becomes the leader and
+# on_demoted() when it stops being one (lease lost, or the shared server unreachable, in which
+# case another worker takes over once the lease expires).
+class LeaderElection:
+    def __init__(self, lease, on_elected, on_demoted=None, interval=None):
+        self.lease = lease
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval or lease.ttl / 3
+        self.is_leader = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        if self.is_leader:
+            self._demote()
+            try:
+                self.lease.release()
+            except Exception as e:
+                logging.warning(f"Releasing {self.lease.key} failed: {e}")
+
+    def _demote(self):
+        self.is_leader = False
+        if self.on_demoted:
+            self.on_demoted()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                held = self.lease.acquire()
+            except Exception as e:
+                logging.warning(f"Leader lease {self.lease.key} unavailable: {e}")
+                held = False
+            if held and not self.is_leader:
+                logging.info(f"{worker_name()} is now the leader for {self.lease.key}")
+                self.is_leader = True
+                self.on_elected()
+            elif not held and self.is_leader:
+                logging.info(f"{worker_name()} lost {self.lease.key}")
+                self._demote()
+            self._stopped.wait(self.interval)
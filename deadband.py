@@ -0,0 +1,57 @@
+import math
+from datetime import datetime
+
+EARTH_RADIUS_M = 6371008.8
+
+
+# Great-circle distance in metres
+def distance_m(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _epoch(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+# Ingest-time dead-band filter for change-only storage.
+#
+# A fix is stored when its device has no stored fix yet, has moved more than `min_distance`
+# metres from its last stored fix, has changed state, district or status, or has had nothing
+# stored for `max_silence` seconds (a heartbeat that bounds how far back the last stored fix
+# can be). Any other fix repeats the last stored one within the dead-band: it only refreshes
+# the device's latest position, and readers treat each stored fix as holding until the next.
+class DeadbandFilter:
+    def __init__(self, columns, min_distance=50.0, max_silence=900.0):
+        self.min_distance = min_distance
+        self.max_silence = max_silence
+        self._index = {name: columns.index(name) for name in
+                       ('timestamp', 'device_id', 'latitude', 'longitude', 'state', 'district', 'status')}
+        self._last = {}  # device_id -> (latitude, longitude, state, district, status, epoch) of the last stored fix
+        self.seen = 0
+        self.stored = 0
+
+    # Split records into (stored, repeats), each in input order
+    def split(self, records):
+        i = self._index
+        stored, repeats = [], []
+        for record in records:
+            latitude, longitude = record[i['latitude']], record[i['longitude']]
+            area_status = (record[i['state']], record[i['district']], record[i['status']])
+            epoch = _epoch(record[i['timestamp']])
+            last = self._last.get(record[i['device_id']])
+            if (last is None or last[2:5] != area_status or epoch - last[5] >= self.max_silence
+                    or latitude is None or last[0] is None
+                    or distance_m(last[0], last[1], latitude, longitude) > self.min_distance):
+                self._last[record[i['device_id']]] = (latitude, longitude, *area_status, epoch)
+                stored.append(record)
+            else:
+                repeats.append(record)
+        self.seen += len(records)
+        self.stored += len(stored)
+        return stored, repeats
@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+
+# One batch of control messages (the same action for a set of devices) and its progress
+class FanoutJob:
+    def __init__(self, action, device_ids, description=''):
+        self.id = uuid.uuid4().hex
+        self.action = action
+        self.device_ids = device_ids
+        self.description = description
+        self.status = 'queued'
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'action': self.action,
+            'description': self.description,
+            'status': self.status,
+            'total': len(self.device_ids),
+            'sent': self.sent,
+            'acked': self.acked,
+            'failed': self.failed,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+# Publishes terminal control messages off the request thread.
+#
+# Jobs go onto a bounded queue drained by a worker thread. Each job's messages are paced by
+# rate_limit (messages/s, 0 for unlimited) and published with the configured QoS; with QoS >= 1
+# a message only counts as acked once the broker has confirmed it. Places on the queue can be
+# reserved ahead of the change a job notifies about, so a full queue refuses the change instead
+# of leaving it applied with its notifications lost.
+class FanoutService:
+    def __init__(self, client, qos=1, rate_limit=500, ack_timeout=10.0, max_pending_jobs=100, history=1000):
+        self.client = client
+        self.qos = qos
+        self.rate_limit = rate_limit
+        self.ack_timeout = ack_timeout
+        self.history = history
+        self.max_pending_jobs = max_pending_jobs
+        self._queue = queue.Queue()  # bounded by max_pending_jobs together with _reserved
+        self._reserved = 0
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    # Queue a job and return it immediately; raises queue.Full when too many jobs are pending
+    def submit(self, action, device_ids, description=''):
+        return self._submit(FanoutJob(action, list(device_ids), description), reserved=False)
+
+    # Reserve a place on the queue for one job and yield a submit() that uses it; the place is
+    # handed back if nothing is submitted. Raises queue.Full when too many jobs are pending.
+    @contextmanager
+    def reserve(self):
+        with self._lock:
+            if self._queue.qsize() + self._reserved >= self.max_pending_jobs:
+                raise queue.Full
+            self._reserved += 1
+        held = [True]
+
+        def submit(action, device_ids, description=''):
+            if not held[0]:
+                raise RuntimeError('Reserved fan-out place already used')
+            held[0] = False
+            return self._submit(FanoutJob(action, list(device_ids), description), reserved=True)
+
+        try:
+            yield submit
+        finally:
+            if held[0]:
+                with self._lock:
+                    self._reserved -= 1
+
+    def _submit(self, job, reserved):
+        with self._lock:
+            if reserved:
+                self._reserved -= 1
+            elif self._queue.qsize() + self._reserved >= self.max_pending_jobs:
+                raise queue.Full
+            self._queue.put_nowait(job)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._publish(job)
+                job.status = 'completed' if not job.failed else 'completed_with_errors'
+            except Exception as e:
+                logging.error(f"Fan-out job {job.id} failed: {e}")
+                job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+
+    def _publish(self, job):
+        job.status = 'running'
+        interval = 1.0 / self.rate_limit if self.rate_limit else 0.0
+        next_at = time.monotonic()
+        unacked = deque()
+
+        for device_id in job.device_ids:
+            if interval:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at = max(next_at, time.monotonic() - interval) + interval
+
+            info = self.client.publish(f"terminal/{device_id}/control", job.action, qos=self.qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                job.failed += 1
+                continue
+            job.sent += 1
+            unacked.append(info)
+            while unacked and unacked[0].is_published():
+                unacked.popleft()
+                job.acked += 1
+
+        # Wait (bounded) for the broker to confirm what is still outstanding
+        deadline = time.monotonic() + self.ack_timeout
+        for info in unacked:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except (RuntimeError, ValueError):
+                pass
+            if info.is_published():
+                job.acked += 1
+            else:
+                job.failed += 1
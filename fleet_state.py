@@ -0,0 +1,160 @@
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+
+# Bits of FleetState.flags
+LOCATED = 1
+INACTIVE = 2
+
+
+def _epoch(timestamp):
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+# Status in the vocabulary of the fleet views: 'active', or 'inactive' for anything else (such as
+# the resolvers' 'DISABLED'); an unknown status counts as active
+def fleet_status(status):
+    return 'active' if status is None or status.lower() == 'active' else 'inactive'
+
+
+# Column-oriented store of the latest state of every device.
+#
+# Each device owns one slot in parallel NumPy arrays: latitude, longitude, timestamp (epoch
+# seconds, NaN when unknown), an interned (state, district) code and a flags byte (LOCATED,
+# INACTIVE), i.e. 29 bytes per device plus its id in the slot index. Fleet questions (who is in
+# this district, in this polygon, inactive) are answered with boolean masks over whole columns
+# instead of loading rows from the database.
+class FleetState:
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._size = 0
+        self._slots = {}  # device_id -> slot
+        self._device_ids = []  # slot -> device_id
+        self._areas = []  # area code -> (state, district)
+        self._area_codes = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        def grow(array, dtype, fill):
+            new = np.full(capacity, fill, dtype=dtype)
+            if array is not None:
+                new[:self._size] = array[:self._size]
+            return new
+        self.latitude = grow(getattr(self, 'latitude', None), np.float64, np.nan)
+        self.longitude = grow(getattr(self, 'longitude', None), np.float64, np.nan)
+        self.timestamp = grow(getattr(self, 'timestamp', None), np.float64, np.nan)
+        self.area = grow(getattr(self, 'area', None), np.int32, -1)
+        self.flags = grow(getattr(self, 'flags', None), np.uint8, 0)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, device_id):
+        return device_id in self._slots
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.latitude, self.longitude, self.timestamp, self.area, self.flags))
+
+    def _area_code(self, state, district):
+        key = (state, district)
+        code = self._area_codes.get(key)
+        if code is None:
+            code = self._area_codes[key] = len(self._areas)
+            self._areas.append(key)
+        return code
+
+    def _slot(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            if self._size == len(self.flags):
+                self._allocate(2 * len(self.flags))
+            slot = self._slots[device_id] = self._size
+            self._device_ids.append(device_id)
+            self._size += 1
+        return slot
+
+    # Merge a change for one device; fields left out (or None) keep their previous value
+    def update(self, device_id, latitude=None, longitude=None, timestamp=None, status=None,
+               state=None, district=None, **_):
+        with self._lock:
+            slot = self._slot(device_id)
+            if latitude is not None and longitude is not None:
+                self.latitude[slot] = latitude
+                self.longitude[slot] = longitude
+                self.flags[slot] |= LOCATED
+            if timestamp is not None:
+                self.timestamp[slot] = _epoch(timestamp)
+            if status is not None:
+                if fleet_status(status) == 'active':
+                    self.flags[slot] &= ~np.uint8(INACTIVE)
+                else:
+                    self.flags[slot] |= INACTIVE
+            if state is not None or district is not None:
+                previous = self._areas[self.area[slot]] if self.area[slot] >= 0 else (None, None)
+                self.area[slot] = self._area_code(
+                    state if state is not None else previous[0],
+                    district if district is not None else previous[1],
+                )
+
+    # Slots matching every given filter, in slot order
+    def select(self, state=None, district=None, status=None, bbox=None, located=False):
+        with self._lock:
+            n = self._size
+            mask = np.ones(n, dtype=bool)
+            if state is not None or district is not None:
+                codes = [code for code, (s, d) in enumerate(self._areas)
+                         if (state is None or s == state) and (district is None or d == district)]
+                mask &= np.isin(self.area[:n], codes)
+            if status is not None:
+                inactive = (self.flags[:n] & INACTIVE) != 0
+                mask &= inactive if status.lower() != 'active' else ~inactive
+            if located or bbox is not None:
+                mask &= (self.flags[:n] & LOCATED) != 0
+            if bbox is not None:
+                min_lon, min_lat, max_lon, max_lat = bbox
+                lats, lons = self.latitude[:n], self.longitude[:n]
+                mask &= (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+            return np.flatnonzero(mask)
+
+    # Slots of located devices inside a (prepared) geometry: bounding-box mask, then contains_xy
+    def within(self, geometry, **filters):
+        slots = self.select(bbox=geometry.bounds, **filters)
+        if not len(slots):
+            return slots
+        inside = shapely.contains_xy(geometry, self.longitude[slots], self.latitude[slots])
+        return slots[inside]
+
+    # Row dicts for slots, ordered by device id
+    def rows(self, slots=None):
+        with self._lock:
+            if slots is None:
+                slots = np.arange(self._size)
+            rows = []
+            for slot, lat, lon, ts, area, flags in zip(
+                slots.tolist(), self.latitude[slots].tolist(), self.longitude[slots].tolist(),
+                self.timestamp[slots].tolist(), self.area[slots].tolist(), self.flags[slots].tolist()
+            ):
+                located = flags & LOCATED
+                state, district = self._areas[area] if area >= 0 else (None, None)
+                rows.append({
+                    'device_id': self._device_ids[slot],
+                    'latitude': lat if located else None,
+                    'longitude': lon if located else None,
+                    'timestamp': datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
+                    if ts == ts else None,
+                    'status': 'inactive' if flags & INACTIVE else 'active',
+                    'state': state,
+                    'district': district,
+                })
+        rows.sort(key=lambda row: row['device_id'])
+        return rows
@@ -1,14 +1,24 @@
+import argparse
 import csv
+import io
 import json
 import os
 import random
 import time
 from datetime import datetime
 from random import uniform
-from shapely.geometry import shape, Point, Polygon
+from shapely.geometry import Point, Polygon
 import psycopg2
 from psycopg2.extras import execute_values
-from pyle38 import Tile38
+
+from boundaries import DistrictStore
+from deadband import DeadbandFilter
+from geocells import encode as geohash
+from geocoder import ReverseGeocoder
+from geofence_engine import GeofenceEngine
+from ingest import IngestPipeline
+from partitions import CREATE_ROLLUP_SQL, PartitionMaintainer, ensure_partitioned_table, ensure_partitions
+from tile38_pool import Tile38StatusResolver
 
 # Database Configuration
 DB_CONFIG = {
@@ -19,30 +29,67 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'terminal_data_db')
 }
 
+# Column order of the record tuples produced by TerminalDataGenerator.generate_data
+TERMINAL_DATA_COLUMNS = (
+    'timestamp', 'sai', 'device_id', 'sbc_id', 'sequence_num', 'mlr_option_flag', 'latitude', 'longitude',
+    'district', 'state', 'velocity', 'track_angle', 'azimuth', 'elevation', 'rx_esno', 'tx_esno', 'rate_string',
+    'modem_output_power', 'cal_ant_eirp', 'mlr_sat_beam_id', 'mbs_option_flag', 'mbs_sat_beam_id',
+    'error_index', 'vsat_mgmt_addr', 'num_msg_processed', 'status', 'cell'
+)
+
+# Column definitions of terminal_data (see DatabaseManager.create_table_if_not_exists; columns
+# added later, such as cell and the dictionary codes, are added with ALTER TABLE there)
+TERMINAL_DATA_COLUMNS_SQL = """
+    id INT NOT NULL DEFAULT nextval('terminal_data_id_seq'),
+    timestamp TIMESTAMP NOT NULL,
+    sai INT,
+    device_id TEXT,
+    sbc_id INT,
+    sequence_num INT,
+    mlr_option_flag TEXT,
+    latitude FLOAT,
+    longitude FLOAT,
+    district TEXT,
+    state TEXT,
+    velocity FLOAT,
+    track_angle FLOAT,
+    azimuth FLOAT,
+    elevation FLOAT,
+    rx_esno FLOAT,
+    tx_esno FLOAT,
+    rate_string TEXT,
+    modem_output_power FLOAT,
+    cal_ant_eirp FLOAT,
+    mlr_sat_beam_id TEXT,
+    mbs_option_flag TEXT,
+    mbs_sat_beam_id TEXT,
+    error_index INT,
+    vsat_mgmt_addr TEXT,
+    num_msg_processed INT,
+    status VARCHAR(20) DEFAULT 'ACTIVE'
+"""
+
+# Repetitive text columns of terminal_data that are stored as <column>_code, an id in the
+# terminal_strings dictionary; the text columns stay for rows written before the codes existed
+DICTIONARY_COLUMNS = (
+    'mlr_option_flag', 'rate_string', 'mlr_sat_beam_id', 'mbs_option_flag', 'mbs_sat_beam_id', 'vsat_mgmt_addr'
+)
+
+# terminal_data with the dictionary columns decoded, in TERMINAL_DATA_COLUMNS order
+CREATE_DECODED_VIEW_SQL = (
+    "CREATE OR REPLACE VIEW terminal_data_decoded AS SELECT d.id, "
+    + ', '.join(f"coalesce(d.{c}, s{i}.value) AS {c}" if c in DICTIONARY_COLUMNS else f"d.{c}"
+                for i, c in enumerate(TERMINAL_DATA_COLUMNS))
+    + " FROM terminal_data d "
+    + ' '.join(f"LEFT JOIN terminal_strings s{i} ON s{i}.id = d.{c}_code"
+               for i, c in enumerate(TERMINAL_DATA_COLUMNS) if c in DICTIONARY_COLUMNS)
+)
+
 # Load GeoJSON data for districts and states
 def load_geojson(file_path):
     with open(file_path) as f:
         return json.load(f)
 
-# Get district from coordinates
-def get_district_from_coordinates(latitude, longitude, district_features):
-    point = Point(longitude, latitude)
-    for feature in district_features:
-        district_name = feature['properties']['NAME_2']
-        polygon = shape(feature['geometry'])
-        if polygon.contains(point):
-            return district_name
-    return 'Unknown'
-
-# Get state from coordinates
-def get_state_from_coordinates(latitude, longitude, states_shapes):
-    point = Point(longitude, latitude)
-    for state, polygons in states_shapes.items():
-        for polygon in polygons:
-            if polygon.contains(point):
-                return state
-    return 'Unknown'
-
 # Define India's boundary polygon
 INDIA_BOUNDARY = Polygon([
     [37.109318, 75.298346], [35.860280, 79.980722], [30.453842, 81.582569], [28.879888, 80.022675],
@@ -73,6 +120,15 @@ def generate_coordinates(latitude, longitude, max_change=1):
             new_longitude -= random.uniform(0, max_change)
         return round(new_latitude, 5), round(new_longitude, 5)
 
+# {geofence key: geometry} for (state, district) geofences, with boundaries from a DistrictStore
+def geofence_geometries(areas, store):
+    fences = {}
+    for state, district in areas:
+        boundary = store.get(state, district)
+        if boundary:
+            fences[f"geofence:{state}:{district}"] = boundary.geometry
+    return fences
+
 # Write data to CSV
 def write_to_csv(data, file_path='terminal_data.csv'):
     with open(file_path, 'a', newline='') as file:
@@ -84,6 +140,7 @@ class DatabaseManager:
     def __init__(self, config):
         self.config = config
         self.connection = None
+        self._string_codes = {}  # terminal_strings value -> id
 
     def connect(self):
         self.connection = psycopg2.connect(**self.config)
@@ -97,88 +154,182 @@ class DatabaseManager:
         with self.connection.cursor() as cursor:
             execute_values(cursor, query, data)
 
+    # terminal_strings ids of `values`, adding the ones not in the dictionary yet
+    def string_codes(self, values):
+        missing = sorted({value for value in values if value is not None and value not in self._string_codes})
+        if missing:
+            with self.connection.cursor() as cursor:
+                rows = execute_values(cursor, """
+                    INSERT INTO terminal_strings (value) VALUES %s
+                    ON CONFLICT (value) DO UPDATE SET value = EXCLUDED.value
+                    RETURNING id, value
+                """, [(value,) for value in missing], fetch=True)
+            self._string_codes.update((value, code) for code, value in rows)
+        return self._string_codes
+
+    # Bulk load terminal_data rows with COPY, which is much cheaper per row than INSERT.
+    # Columns listed in `encoded` are written as <column>_code ids into terminal_strings.
+    def copy_rows(self, data, table='terminal_data', columns=TERMINAL_DATA_COLUMNS, encoded=DICTIONARY_COLUMNS):
+        positions = {i for i, column in enumerate(columns) if column in encoded}
+        if positions:
+            codes = self.string_codes({row[i] for row in data for i in positions})
+
+            def encode(row):
+                return [codes[value] if i in positions and value is not None else value
+                        for i, value in enumerate(row)]
+            data = map(encode, data)
+            columns = [f"{column}_code" if i in positions else column for i, column in enumerate(columns)]
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(data)
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    # Active (state, district) geofences; the table is owned by app.py and may not exist yet
+    def fetch_geofences(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('geofences')")
+            if cursor.fetchone()[0] is None:
+                geofences = []
+            else:
+                cursor.execute("SELECT state, district FROM geofences")
+                geofences = cursor.fetchall()
+        self.connection.commit()  # don't leave the connection idle in a transaction between ticks
+        return geofences
+
     def commit(self):
         self.connection.commit()
 
+    def rollback(self):
+        self.connection.rollback()
+        self._string_codes.clear()  # ids added in the rolled back transaction are gone
+
     def create_table_if_not_exists(self):
-        create_table_sql = """
-        CREATE TABLE IF NOT EXISTS terminal_data (
-            id SERIAL PRIMARY KEY,
-            timestamp TIMESTAMP,
-            sai INT,
-            device_id TEXT,
-            sbc_id INT,
-            sequence_num INT,
-            mlr_option_flag TEXT,
-            latitude FLOAT,
-            longitude FLOAT,
-            district TEXT,
-            state TEXT,
-            velocity FLOAT,
-            track_angle FLOAT,
-            azimuth FLOAT,
-            elevation FLOAT,
-            rx_esno FLOAT,
-            tx_esno FLOAT,
-            rate_string TEXT,
-            modem_output_power FLOAT,
-            cal_ant_eirp FLOAT,
-            mlr_sat_beam_id TEXT,
-            mbs_option_flag TEXT,
-            mbs_sat_beam_id TEXT,
-            error_index INT,
-            vsat_mgmt_addr TEXT,
-            num_msg_processed INT,
-            status VARCHAR(20) DEFAULT 'ACTIVE'
-        );
-        """
+        # terminal_data is range-partitioned on timestamp; partitions.py creates upcoming
+        # partitions, applies retention and maintains the hourly rollups
         with self.connection.cursor() as cursor:
-            cursor.execute(create_table_sql)
+            ensure_partitioned_table(cursor, 'terminal_data', TERMINAL_DATA_COLUMNS_SQL)
+            ensure_partitions(cursor, 'terminal_data')
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS terminal_strings (
+                id SERIAL PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE
+            );
+            """)
+            cursor.execute("ALTER TABLE terminal_data " + ", ".join(
+                [f"ADD COLUMN IF NOT EXISTS {column}_code INT" for column in DICTIONARY_COLUMNS]
+                + ['ADD COLUMN IF NOT EXISTS cell TEXT COLLATE "C"']
+            ))
+            cursor.execute(CREATE_DECODED_VIEW_SQL)
+            # Geohash prefix ranges (app.py rows_in_cells) within a time window
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_terminal_data_cell_timestamp ON terminal_data (cell, timestamp);
+            """)
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_terminal_data_device_id_timestamp
+                ON terminal_data (device_id, timestamp DESC, id DESC);
+            """)
+            cursor.execute(CREATE_ROLLUP_SQL)
 
+        # Latest position per device, kept current by upsert_latest_positions()
         create_table_sql = """
         CREATE TABLE IF NOT EXISTS terminals (
             id SERIAL PRIMARY KEY,
             device_id VARCHAR(255) NOT NULL
         );
+        ALTER TABLE terminals
+            ADD COLUMN IF NOT EXISTS name VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS sai INT,
+            ADD COLUMN IF NOT EXISTS last_latitude FLOAT,
+            ADD COLUMN IF NOT EXISTS last_longitude FLOAT,
+            ADD COLUMN IF NOT EXISTS last_timestamp TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS district TEXT,
+            ADD COLUMN IF NOT EXISTS state TEXT,
+            ADD COLUMN IF NOT EXISTS status VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS cell TEXT COLLATE "C";
+        CREATE UNIQUE INDEX IF NOT EXISTS terminals_device_id_key ON terminals (device_id);
+        CREATE INDEX IF NOT EXISTS ix_terminals_last_timestamp ON terminals (last_timestamp);
+        CREATE INDEX IF NOT EXISTS ix_terminals_cell ON terminals (cell);
         """
         with self.connection.cursor() as cursor:
             cursor.execute(create_table_sql)
+
+        # One-time seed from history so devices that are no longer reporting still show up
+        seed_sql = """
+        INSERT INTO terminals (device_id, name, sai, last_latitude, last_longitude, last_timestamp, district, state, status, cell)
+        SELECT DISTINCT ON (device_id) device_id, device_id, sai, latitude, longitude, timestamp, district, state, status, cell
+        FROM terminal_data
+        WHERE NOT EXISTS (SELECT 1 FROM terminals WHERE last_timestamp IS NOT NULL)
+        ORDER BY device_id, timestamp DESC
+        ON CONFLICT (device_id) DO NOTHING;
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(seed_sql)
         self.connection.commit()
 
+    # Upsert the newest fix of each device in `data` (terminal_data row tuples) into terminals.
+    # terminals.status ('active'/'inactive') is kept by geofence events and the dashboard toggle,
+    # so a fix's resolved status only seeds it for a device seen for the first time.
+    def upsert_latest_positions(self, data):
+        latest = {}
+        for row in data:
+            device_id = row[2]
+            if device_id not in latest or str(row[0]) >= str(latest[device_id][0]):
+                latest[device_id] = row
+
+        upsert_sql = """
+            INSERT INTO terminals (
+                device_id, name, sai, last_latitude, last_longitude, last_timestamp, district, state, status, cell
+            ) VALUES %s
+            ON CONFLICT (device_id) DO UPDATE SET
+                sai = EXCLUDED.sai,
+                last_latitude = EXCLUDED.last_latitude,
+                last_longitude = EXCLUDED.last_longitude,
+                last_timestamp = EXCLUDED.last_timestamp,
+                district = EXCLUDED.district,
+                state = EXCLUDED.state,
+                cell = EXCLUDED.cell
+            WHERE terminals.last_timestamp IS NULL OR EXCLUDED.last_timestamp >= terminals.last_timestamp
+        """
+        self.execute(upsert_sql, [
+            (row[2], row[2], row[1], row[6], row[7], row[0], row[8], row[9],
+             'active' if (row[25] or 'ACTIVE').upper() == 'ACTIVE' else 'inactive', row[26])
+            for row in latest.values()
+        ])
+
 # Terminal Data Generator
 class TerminalDataGenerator:
-    def __init__(self, db_manager, geojson_path):
+    def __init__(self, db_manager, geojson_path, num_terminals=10, status_resolver=None):
         self.db_manager = db_manager
+        self.status_resolver = status_resolver or Tile38StatusResolver()
         self.device_id_start = "1712328952086-29105A"
         self.sai_start = 198086
-        self.district_features = load_geojson(geojson_path)['features']
-        self.states_shapes = self._load_states_shapes(self.district_features)
-        self.initial_coordinates = [
+        self.geocoder = ReverseGeocoder.from_store(DistrictStore.from_geojson(geojson_path))
+        seed_coordinates = [
             (20.5937, 78.9629), (11.059821, 78.387451), (17.12318, 79.208824),
             (29.065773, 76.040497), (27.391277, 73.432617), (15.317277, 75.713890),
             (22.309425, 72.136230), (25.096073, 85.313118), (21.251385, 81.629641),
             (26.8467088, 80.9461592)
         ]
-
-    def _load_states_shapes(self, district_features):
-        states_shapes = {}
-        for feature in district_features:
-            state_name = feature['properties']['NAME_1']
-            polygon = shape(feature['geometry'])  # Convert geometry to Shapely polygon
-            if state_name not in states_shapes:
-                states_shapes[state_name] = []
-            states_shapes[state_name].append(polygon)
-        return states_shapes
+        # Terminals beyond the seed list start scattered around one of the seed points
+        self.initial_coordinates = seed_coordinates[:num_terminals] + [
+            generate_coordinates(*seed_coordinates[i % len(seed_coordinates)], max_change=2)
+            for i in range(len(seed_coordinates), num_terminals)
+        ]
 
     def generate_data(self):
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Fixes are stamped in UTC, the clock partitions, rollups, retention and the API use
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         data_to_write = []
-        for i, coords in enumerate(self.initial_coordinates):
-            latitude, longitude = generate_coordinates(coords[0], coords[1])
-            district = get_district_from_coordinates(latitude, longitude, self.district_features)
-            state = get_state_from_coordinates(latitude, longitude, self.states_shapes)
-            device_id = self.device_id_start + str(i)
-            status = self.get_terminal_status(device_id, latitude, longitude)
+        coordinates = [generate_coordinates(lat, lon) for lat, lon in self.initial_coordinates]
+        locations = self.geocoder.lookup_many([c[0] for c in coordinates], [c[1] for c in coordinates])
+        device_ids = [self.device_id_start + str(i) for i in range(len(coordinates))]
+        statuses = self.status_resolver.resolve_statuses(
+            (device_id, lat, lon) for device_id, (lat, lon) in zip(device_ids, coordinates)
+        )
+        for i, ((latitude, longitude), (state, district), status) in enumerate(zip(coordinates, locations, statuses)):
+            device_id = device_ids[i]
 
             data = (
                 timestamp, self.sai_start + i, device_id, random.randint(1000, 10000),
@@ -187,55 +338,93 @@ class TerminalDataGenerator:
                 round(uniform(0, 90), 2), round(uniform(-10, 50), 2), round(uniform(-10, 50), 2),
                 'Some Rate String', round(uniform(-50, 50), 2), round(uniform(-50, 50), 2), 'Some Beam ID',
                 'Yes' if random.random() > 0.5 else 'No', 'Some Sat Beam ID', random.randint(0, 10),
-                'Some Management Addr', random.randint(0, 1000), status
+                'Some Management Addr', random.randint(0, 1000), status, geohash(latitude, longitude)
             )
             data_to_write.append(data)
         return data_to_write
 
     def get_terminal_status(self, device_id, latitude, longitude):
-    try:
-        tile38 = Tile38('localhost', 9851)
-        response = tile38.intersects('geofences').bounds(latitude - 0.0001, longitude - 0.0001, latitude + 0.0001, longitude + 0.0001).asObjects()
-        if response['ok']:
-            if response['objects']:
-                return 'DISABLED'
-            else:
-                return 'ACTIVE'
-        else:
-            return 'ACTIVE'
-    except Exception as e:
-        print(f"Tile38 query error: {e}")
-        return 'ACTIVE'
+        return self.status_resolver.resolve_statuses([(device_id, latitude, longitude)])[0]
 
 
 # Main function to run the data generator
 def main():
-    geojson_path = 'india_taluk.geojson'
+    parser = argparse.ArgumentParser(description='Generate terminal data and ingest it into PostgreSQL')
+    parser.add_argument('--geojson', default='india_taluk.geojson', help='Boundary file used to geocode fixes')
+    parser.add_argument('--terminals', type=int, default=10, help='Number of simulated terminals')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between reports from each terminal')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per COPY batch')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='Max seconds a row waits before its batch is written')
+    parser.add_argument('--max-in-flight', type=int, default=4, help='Batches queued for writing before producers block')
+    parser.add_argument('--writers', type=int, default=1, help='Parallel writer connections')
+    parser.add_argument('--csv', metavar='PATH', help='Also append every ingested row to this CSV file')
+    parser.add_argument('--status-backend', choices=['tile38', 'engine'], default='tile38',
+                        help='Resolve geofence status through Tile38 or the in-process geofence engine')
+    parser.add_argument('--status-timeout', type=float, default=2.0, help='Seconds to wait for Tile38 status checks per tick')
+    parser.add_argument('--geofence-boundaries', default='india_districts.geojson',
+                        help='District boundaries the geofences table refers to (engine backend)')
+    parser.add_argument('--maintenance-interval', type=float, default=3600,
+                        help='Seconds between terminal_data partition/rollup/retention passes (0 to disable)')
+    parser.add_argument('--storage-mode', choices=['full', 'changes'], default='full',
+                        help='Store every fix, or only fixes that moved, changed area/status or broke a silence')
+    parser.add_argument('--deadband-meters', type=float, default=50.0,
+                        help='Changes mode: minimum movement from the last stored fix worth storing')
+    parser.add_argument('--max-silence', type=float, default=900.0,
+                        help='Changes mode: store a fix anyway once a terminal has had none stored for this many seconds')
+    args = parser.parse_args()
+
     db_manager = DatabaseManager(DB_CONFIG)
     db_manager.connect()
+    if args.status_backend == 'engine':
+        geofence_store = DistrictStore.from_geojson(args.geofence_boundaries)
+        status_resolver = GeofenceEngine()
+    else:
+        status_resolver = Tile38StatusResolver(timeout=args.status_timeout)
+    data_generator = TerminalDataGenerator(
+        db_manager, args.geojson, num_terminals=args.terminals, status_resolver=status_resolver
+    )
 
-    data_generator = TerminalDataGenerator(db_manager, geojson_path)
-
-    while True:
-        try:
-            generated_data = data_generator.generate_data()
-            write_to_csv(generated_data)
-            insert_query = """
-                INSERT INTO terminal_data (
-                    timestamp, sai, device_id, sbc_id, sequence_num, mlr_option_flag, latitude, longitude,
-                    district, state, velocity, track_angle, azimuth, elevation, rx_esno, tx_esno, rate_string,
-                    modem_output_power, cal_ant_eirp, mlr_sat_beam_id, mbs_option_flag, mbs_sat_beam_id,
-                    error_index, vsat_mgmt_addr, num_msg_processed, status
-                ) VALUES %s
-            """
-            db_manager.execute(insert_query, generated_data)
-            db_manager.commit()
-            print("Data inserted successfully")
-            time.sleep(60)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            db_manager.close()
-            break
+    def connect_writer():
+        writer = DatabaseManager(DB_CONFIG)
+        writer.connect()
+        return writer
+
+    pipeline = IngestPipeline(
+        connect_writer,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        max_in_flight=args.max_in_flight,
+        writers=args.writers,
+        mirror=(lambda batch: write_to_csv(batch, args.csv)) if args.csv else None,
+    ).start()
+    deadband = DeadbandFilter(TERMINAL_DATA_COLUMNS, args.deadband_meters, args.max_silence) \
+        if args.storage_mode == 'changes' else None
+    maintainer = PartitionMaintainer(connect_writer, every=args.maintenance_interval).start() \
+        if args.maintenance_interval > 0 else None
+
+    try:
+        while True:
+            started = time.monotonic()
+            if args.status_backend == 'engine':
+                # Pick up geofences added or removed through the dashboard since the last tick
+                status_resolver.set_geofences(geofence_geometries(db_manager.fetch_geofences(), geofence_store))
+            records = data_generator.generate_data()
+            if deadband:
+                records, repeats = deadband.split(records)
+                pipeline.submit_many(repeats, store=False)
+            pipeline.submit_many(records)
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"An error occurred: {e}")
+    finally:
+        pipeline.close()
+        if maintainer:
+            maintainer.stop()
+        if args.status_backend == 'tile38':
+            status_resolver.close()
+        db_manager.close()
 
 if __name__ == "__main__":
     main()
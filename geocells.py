@@ -0,0 +1,192 @@
+import collections
+import math
+import os
+
+import numpy as np
+import shapely
+
+from deadband import EARTH_RADIUS_M, distance_m
+
+# Length of the geohash stored in terminal_data.cell and terminals.cell (7 is ~150 m x 150 m)
+GEOHASH_PRECISION = int(os.getenv('GEOHASH_PRECISION', 7))
+
+# Most cells a search area is covered with; larger areas are covered with coarser cells
+MAX_COVER_CELLS = int(os.getenv('GEOHASH_MAX_COVER_CELLS', 256))
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'  # in ASCII order, so prefixes sort like their cells
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+
+# Geohash of a point; None for a fix without a position
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    if latitude is None or longitude is None:
+        return None
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    chars, value, bits, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                value, lon_lo = value * 2 + 1, mid
+            else:
+                value, lon_hi = value * 2, mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                value, lat_lo = value * 2 + 1, mid
+            else:
+                value, lat_hi = value * 2, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            value, bits = 0, 0
+    return ''.join(chars)
+
+
+# (min_lon, min_lat, max_lon, max_lat) of a cell
+def bounds(cell):
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lon_lo, lat_lo, lon_hi, lat_hi
+
+
+# (width, height) in degrees of the cells of a precision
+def cell_size(precision):
+    return 360.0 / 2 ** ((5 * precision + 1) // 2), 180.0 / 2 ** (5 * precision // 2)
+
+
+# Cells of one precision whose union covers bbox: the finest precision up to max_precision
+# that needs at most max_cells of them
+def cover(bbox, max_precision=GEOHASH_PRECISION, max_cells=MAX_COVER_CELLS):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    for precision in range(max_precision, 0, -1):
+        width, height = cell_size(precision)
+        columns = range(max(int((min_lon + 180) // width), 0),
+                        min(int((max_lon + 180) // width), round(360 / width) - 1) + 1)
+        rows = range(max(int((min_lat + 90) // height), 0),
+                     min(int((max_lat + 90) // height), round(180 / height) - 1) + 1)
+        if len(columns) * len(rows) <= max_cells or precision == 1:
+            break
+    return sorted(encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+                  for column in columns for row in rows)
+
+
+# Merge sorted, non-overlapping prefixes into [low, high) ranges of the full-length cell
+# column; high is None when the range runs to the end of the keyspace
+def prefix_ranges(prefixes):
+    ranges = []
+    for prefix in prefixes:
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = _successor(prefix)
+        else:
+            ranges.append([prefix, _successor(prefix)])
+    return [tuple(r) for r in ranges]
+
+
+# Smallest string greater than every cell starting with prefix
+def _successor(prefix):
+    prefix = prefix.rstrip(_BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + _BASE32[_DECODE[prefix[-1]] + 1]
+
+
+# Search areas: a bbox, exact tests for points (vectorised over arrays) and for whole cells.
+# covering_cells() uses the cell tests so that only points in edge cells need the exact test.
+class BoxArea:
+    def __init__(self, min_lon, min_lat, max_lon, max_lat):
+        self.bbox = (min_lon, min_lat, max_lon, max_lat)
+
+    def contains(self, latitudes, longitudes):
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return (longitudes >= min_lon) & (longitudes <= max_lon) & (latitudes >= min_lat) & (latitudes <= max_lat)
+
+    # True if the whole cell is inside, False if it overlaps the edge, None if it is outside
+    def cell_inside(self, cell_bounds):
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if (cell_bounds[0] > max_lon or cell_bounds[2] < min_lon
+                or cell_bounds[1] > max_lat or cell_bounds[3] < min_lat):
+            return None
+        return (cell_bounds[0] >= min_lon and cell_bounds[2] <= max_lon
+                and cell_bounds[1] >= min_lat and cell_bounds[3] <= max_lat)
+
+
+class RadiusArea:
+    def __init__(self, latitude, longitude, radius):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius  # metres
+        d_lat = math.degrees(radius / EARTH_RADIUS_M)
+        d_lon = min(180.0, d_lat / max(math.cos(math.radians(latitude)), 1e-9))
+        self.bbox = (longitude - d_lon, max(-90.0, latitude - d_lat), longitude + d_lon, min(90.0, latitude + d_lat))
+
+    def _distances(self, latitudes, longitudes):
+        phi1, phi2 = math.radians(self.latitude), np.radians(latitudes)
+        a = (np.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * np.cos(phi2) * np.sin(np.radians(longitudes - self.longitude) / 2) ** 2)
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+    def contains(self, latitudes, longitudes):
+        return self._distances(latitudes, longitudes) <= self.radius
+
+    def cell_inside(self, cell_bounds):
+        min_lon, min_lat, max_lon, max_lat = cell_bounds
+        # A disc is convex: the cell is inside when its corners are; it is outside when the
+        # cell point nearest to the centre is
+        if all(distance_m(self.latitude, self.longitude, lat, lon) <= self.radius
+               for lat, lon in ((min_lat, min_lon), (min_lat, max_lon), (max_lat, min_lon), (max_lat, max_lon))):
+            return True
+        nearest = distance_m(self.latitude, self.longitude,
+                             min(max(self.latitude, min_lat), max_lat), min(max(self.longitude, min_lon), max_lon))
+        return False if nearest <= self.radius else None
+
+
+class GeometryArea:
+    def __init__(self, geometry):
+        shapely.prepare(geometry)
+        self.geometry = geometry
+        self.bbox = geometry.bounds
+
+    def contains(self, latitudes, longitudes):
+        return shapely.contains_xy(self.geometry, longitudes, latitudes)
+
+    def cell_inside(self, cell_bounds):
+        cell = shapely.box(*cell_bounds)
+        if not self.geometry.intersects(cell):
+            return None
+        return self.geometry.contains(cell)
+
+
+# Cells covering an area, split into (inside, edge): points in inside cells are in the area,
+# points in edge cells need area.contains(); cells outside the area are dropped. Starts from a
+# coarse cover and splits edge cells, coarsest first, into their 32 children while the total
+# stays within max_cells, so only a thin band along the boundary is left to refine.
+def covering_cells(area, max_precision=GEOHASH_PRECISION, max_cells=MAX_COVER_CELLS):
+    inside, edge, done = [], collections.deque(), []
+
+    def classify(cells):
+        for cell in cells:
+            verdict = area.cell_inside(bounds(cell))
+            if verdict is not None:
+                (inside if verdict else edge).append(cell)
+
+    classify(cover(area.bbox, max_precision, max(1, max_cells // len(_BASE32))))
+    while edge:
+        cell = edge.popleft()
+        if len(cell) >= max_precision or len(inside) + len(edge) + len(done) + len(_BASE32) > max_cells:
+            done.append(cell)
+        else:
+            classify(cell + char for char in _BASE32)
+    return sorted(inside), sorted(done)
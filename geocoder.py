@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+UNKNOWN = 'Unknown'
+
+
+# Reverse geocoder over district/taluk boundaries.
+# Geometries are parsed and prepared once; lookups go through an STRtree bounding-box
+# query followed by an exact (prepared) point-in-polygon test on the candidates only.
+class ReverseGeocoder:
+    def __init__(self, names, geometries):
+        self.names = list(names)
+        self.geometries = np.array(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+        # Overall extent, used to reject points outside every boundary without touching the tree
+        self.bounds = tuple(shapely.total_bounds(self.geometries)) if len(self.names) else (0.0, 0.0, -1.0, -1.0)
+
+    @classmethod
+    def from_features(cls, features, state_key='NAME_1', district_key='NAME_2'):
+        names = [(f['properties'][state_key], f['properties'][district_key]) for f in features]
+        return cls(names, [shape(f['geometry']) for f in features])
+
+    # Share the already-parsed geometries of a boundaries.DistrictStore
+    @classmethod
+    def from_store(cls, store):
+        entries = list(store)
+        return cls([(e.state, e.district) for e in entries], [e.geometry for e in entries])
+
+    @classmethod
+    def from_geojson(cls, file_path, **kwargs):
+        with open(file_path) as f:
+            return cls.from_features(json.load(f)['features'], **kwargs)
+
+    def __len__(self):
+        return len(self.names)
+
+    # Return (state, district) for a single coordinate
+    def lookup(self, latitude, longitude):
+        return self.lookup_many([latitude], [longitude])[0]
+
+    # Return a list of (state, district) tuples, one per coordinate pair
+    def lookup_many(self, latitudes, longitudes):
+        lats = np.asarray(latitudes, dtype=float)
+        lons = np.asarray(longitudes, dtype=float)
+        if lats.shape != lons.shape:
+            raise ValueError('latitudes and longitudes must have the same length')
+
+        results = [(UNKNOWN, UNKNOWN)] * len(lats)
+        minx, miny, maxx, maxy = self.bounds
+        in_extent = np.nonzero((lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy))[0]
+        if len(in_extent) == 0:
+            return results
+
+        # Bounding-box candidates from the tree, then the exact test against prepared geometries
+        points = shapely.points(lons[in_extent], lats[in_extent])
+        point_idx, geom_idx = self.tree.query(points)
+        hits = shapely.contains_xy(self.geometries[geom_idx], lons[in_extent][point_idx], lats[in_extent][point_idx])
+
+        # A point on a shared border can match more than one feature; keep the first in file
+        # order, which is what the old linear scan returned.
+        best = np.full(len(in_extent), len(self.names))
+        np.minimum.at(best, point_idx[hits], geom_idx[hits])
+        for i, feature_idx in enumerate(best):
+            if feature_idx < len(self.names):
+                results[in_extent[i]] = self.names[feature_idx]
+        return results
@@ -0,0 +1,128 @@
+import threading
+
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+ENTER = 'enter'
+EXIT = 'exit'
+_EMPTY = frozenset()
+
+
+# In-process geofence evaluation.
+#
+# Active geofences sit in an STRtree over prepared geometries. Each batch of fixes is tested in
+# one vectorized pass (tree bounding-box query, then contains_xy on the candidates only), and the
+# per-device set of containing geofences is compared with the previous one so that enter/exit
+# transitions are produced only when membership actually changes.
+#
+# resolve_statuses() has the same signature as tile38_pool.Tile38StatusResolver, so either can be
+# used as the status backend; update() additionally reports transitions, which Tile38 delivers
+# through SETHOOK webhooks instead.
+class GeofenceEngine:
+    def __init__(self, inside_status='DISABLED', outside_status='ACTIVE'):
+        self.inside_status = inside_status
+        self.outside_status = outside_status
+        self._lock = threading.Lock()
+        self._fences = {}
+        self._membership = {}  # device_id -> frozenset of geofence keys; devices outside every fence are omitted
+        self._rebuild()
+
+    def _rebuild(self):
+        self._keys = list(self._fences)
+        self._geometries = np.array([self._fences[k] for k in self._keys], dtype=object)
+        shapely.prepare(self._geometries)
+        self._tree = STRtree(self._geometries)
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    # Replace the active geofences ({key: geometry}); a no-op when neither the keys nor any
+    # geometry have changed
+    def set_geofences(self, fences):
+        with self._lock:
+            if fences.keys() == self._fences.keys() and all(
+                    geometry is self._fences[key] or shapely.equals_exact(geometry, self._fences[key], tolerance=0)
+                    for key, geometry in fences.items()):
+                return False
+            self._fences = dict(fences)
+            self._rebuild()
+            self._forget_missing()
+            return True
+
+    def add_geofence(self, key, geometry):
+        self.add_geofences({key: geometry})
+
+    def remove_geofence(self, key):
+        self.remove_geofences([key])
+
+    # Add several geofences ({key: geometry}) with a single tree rebuild
+    def add_geofences(self, fences):
+        with self._lock:
+            self._fences.update(fences)
+            self._rebuild()
+
+    def remove_geofences(self, keys):
+        with self._lock:
+            removed = [key for key in keys if self._fences.pop(key, None) is not None]
+            if removed:
+                self._rebuild()
+                self._forget_missing()
+
+    # Drop removed geofences from device state without reporting exits (callers notify on removal)
+    def _forget_missing(self):
+        for device_id, keys in list(self._membership.items()):
+            remaining = keys & self._fences.keys()
+            if remaining:
+                self._membership[device_id] = frozenset(remaining)
+            else:
+                del self._membership[device_id]
+
+    # Map point index -> frozenset of containing geofence keys, for points inside at least one
+    def _contained(self, lats, lons):
+        if not self._keys or not len(lats):
+            return {}
+        point_idx, fence_idx = self._tree.query(shapely.points(lons, lats))
+        hits = shapely.contains_xy(self._geometries[fence_idx], lons[point_idx], lats[point_idx])
+        contained = {}
+        for p, f in zip(point_idx[hits].tolist(), fence_idx[hits].tolist()):
+            contained.setdefault(p, set()).add(self._keys[f])
+        return {p: frozenset(keys) for p, keys in contained.items()}
+
+    @staticmethod
+    def _coordinates(points):
+        lats = np.fromiter((p[1] for p in points), dtype=float, count=len(points))
+        lons = np.fromiter((p[2] for p in points), dtype=float, count=len(points))
+        return lats, lons
+
+    # points: list of (device_id, latitude, longitude); stateless, one status per point
+    def resolve_statuses(self, points):
+        points = list(points)
+        with self._lock:
+            contained = self._contained(*self._coordinates(points))
+        return [self.inside_status if i in contained else self.outside_status for i in range(len(points))]
+
+    # Apply a batch of fixes (device_id, latitude, longitude) in order and return the resulting
+    # transitions as (device_id, geofence_key, 'enter' | 'exit') tuples
+    def update(self, fixes):
+        fixes = list(fixes)
+        transitions = []
+        with self._lock:
+            contained = self._contained(*self._coordinates(fixes))
+            for i, (device_id, _, _) in enumerate(fixes):
+                new = contained.get(i, _EMPTY)
+                old = self._membership.get(device_id, _EMPTY)
+                if new == old:
+                    continue
+                transitions.extend((device_id, key, EXIT) for key in sorted(old - new))
+                transitions.extend((device_id, key, ENTER) for key in sorted(new - old))
+                if new:
+                    self._membership[device_id] = new
+                else:
+                    del self._membership[device_id]
+        return transitions
+
+    def membership(self, device_id):
+        with self._lock:
+            return self._membership.get(device_id, _EMPTY)
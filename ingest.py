@@ -0,0 +1,208 @@
+import logging
+import queue
+import threading
+import time
+
+_STOP = object()
+
+# Longest wait between reconnects and between tries of a batch, in seconds
+MAX_BACKOFF = 30.0
+
+
+# Ingest pipeline stage: buffers a stream of terminal_data records, cuts them into
+# micro-batches by size or age, and hands the batches to writer threads that load them
+# with COPY. The batch queue is bounded, so a slow database blocks submit() (backpressure)
+# instead of letting memory grow without limit; once no writer thread is left, submit()
+# raises RuntimeError instead of blocking forever. Writers reconnect with backoff when the
+# database goes away and retry a batch before counting it as failed. Records submitted with store=False (repeats
+# dropped by a deadband.DeadbandFilter) only refresh the terminals table and are not copied.
+class IngestPipeline:
+    def __init__(self, connect, batch_size=5000, flush_interval=1.0, max_in_flight=4,
+                 writers=1, mirror=None, report_interval=10.0, attempts=3, retry_backoff=1.0):
+        self.connect = connect  # returns a connected genData.DatabaseManager, one per writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.mirror = mirror  # optional callable(batch), e.g. the CSV mirror
+        self.report_interval = report_interval
+        self.attempts = attempts  # tries per batch before it is counted as failed
+        self.retry_backoff = retry_backoff  # first delay between tries and reconnects, doubled up to MAX_BACKOFF
+
+        self._buffer = []
+        self._buffer_started = None
+        self._lock = threading.Lock()
+        self._mirror_lock = threading.Lock()
+        self._batches = queue.Queue(maxsize=max_in_flight)
+        self._closed = threading.Event()
+        self._writers = [threading.Thread(target=self._write_loop, daemon=True) for _ in range(writers)]
+        self._ticker = threading.Thread(target=self._tick_loop, daemon=True)
+
+        self.rows_written = 0
+        self.rows_repeated = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.started_at = None
+        self._last_report = (None, 0)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._last_report = (self.started_at, 0)
+        for writer in self._writers:
+            writer.start()
+        self._ticker.start()
+        return self
+
+    def submit(self, record, store=True):
+        self.submit_many([record], store)
+
+    def submit_many(self, records, store=True):
+        full = []
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.extend((record, store) for record in records)
+            while len(self._buffer) >= self.batch_size:
+                full.append(self._buffer[:self.batch_size])
+                del self._buffer[:self.batch_size]
+            if not self._buffer:
+                self._buffer_started = None
+        for batch in full:
+            self._put(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer, self._buffer_started = self._buffer, [], None
+        if batch:
+            self._put(batch)
+
+    def close(self):
+        self._closed.set()
+        self._ticker.join()
+        try:
+            self.flush()
+            for _ in self._writers:
+                self._put(_STOP)
+        except RuntimeError as e:
+            logging.error(f"Closing ingest pipeline: {e}")
+        for writer in self._writers:
+            writer.join()
+        self.report()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            'rows_written': self.rows_written,
+            'rows_repeated': self.rows_repeated,
+            'batches_written': self.batches_written,
+            'batches_failed': self.batches_failed,
+            'batches_pending': self._batches.qsize(),
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(self.rows_written / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def report(self):
+        now = time.monotonic()
+        last_time, last_rows = self._last_report
+        self._last_report = (now, self.rows_written)
+        window = now - last_time if last_time else 0.0
+        current = (self.rows_written - last_rows) / window if window else 0.0
+        stats = self.stats()
+        repeated = f", {stats['rows_repeated']} repeats not stored" if stats['rows_repeated'] else ''
+        print(f"Ingested {stats['rows_written']} rows in {stats['batches_written']} batches{repeated} "
+              f"({current:.1f} rows/s now, {stats['rows_per_sec']} rows/s overall, "
+              f"{stats['batches_pending']} pending, {stats['batches_failed']} failed)")
+
+    # Queue a batch, blocking while max_in_flight batches are pending, as long as a writer is alive
+    def _put(self, item):
+        while True:
+            if not any(writer.is_alive() for writer in self._writers):
+                raise RuntimeError(f"No ingest writer is running; {self._batches.qsize()} batches are stuck")
+            try:
+                self._batches.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    # Flush partially filled batches once they are older than flush_interval, and report throughput
+    def _tick_loop(self):
+        while not self._closed.wait(min(self.flush_interval, self.report_interval) / 2):
+            with self._lock:
+                due = self._buffer_started is not None and time.monotonic() - self._buffer_started >= self.flush_interval
+            if due:
+                self.flush()
+            if time.monotonic() - self._last_report[0] >= self.report_interval:
+                self.report()
+
+    # Connect a writer, retrying with backoff until the database is back; once the pipeline
+    # is closed, gives up (None) after `attempts` failed tries
+    def _connect(self):
+        delay, tries = self.retry_backoff, 0
+        while True:
+            try:
+                return self.connect()
+            except Exception as e:
+                tries += 1
+                if self._closed.is_set() and tries >= self.attempts:
+                    logging.error(f"Ingest writer failed to connect: {e}; giving up")
+                    return None
+                logging.error(f"Ingest writer failed to connect: {e}; retrying in {delay:.1f}s")
+            self._closed.wait(delay)
+            delay = min(delay * 2, MAX_BACKOFF)
+
+    # Roll back a failed batch; a connection that can't roll back is broken, so drop it and let
+    # the next try reconnect
+    def _recover(self, db_manager):
+        try:
+            db_manager.rollback()
+            return db_manager
+        except Exception as e:
+            logging.warning(f"Ingest writer lost its connection ({e}); reconnecting")
+            try:
+                db_manager.close()
+            except Exception:
+                pass
+            return None
+
+    def _write_loop(self):
+        db_manager = self._connect()
+        try:
+            while True:
+                batch = self._batches.get()
+                if batch is _STOP:
+                    break
+                stored = [record for record, store in batch if store]
+                written = False
+                for attempt in range(1, self.attempts + 1):
+                    if db_manager is None:
+                        db_manager = self._connect()
+                        if db_manager is None:
+                            break
+                    try:
+                        if stored:
+                            db_manager.copy_rows(stored)
+                        db_manager.upsert_latest_positions([record for record, _ in batch])
+                        db_manager.commit()
+                        written = True
+                        break
+                    except Exception as e:
+                        logging.error(f"Failed to ingest batch of {len(batch)} rows "
+                                      f"(attempt {attempt}/{self.attempts}): {e}")
+                        db_manager = self._recover(db_manager)
+                        if attempt < self.attempts:
+                            time.sleep(min(self.retry_backoff * 2 ** (attempt - 1), MAX_BACKOFF))
+                if not written:
+                    with self._lock:
+                        self.batches_failed += 1
+                    continue
+
+                if self.mirror and stored:
+                    with self._mirror_lock:
+                        self.mirror(stored)
+                with self._lock:
+                    self.rows_written += len(stored)
+                    self.rows_repeated += len(batch) - len(stored)
+                    self.batches_written += 1
+        except Exception:
+            logging.exception("Ingest writer stopped")
+        finally:
+            if db_manager is not None:
+                db_manager.close()
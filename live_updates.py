@@ -0,0 +1,298 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Fields that locate a device; remembered per device so status-only changes can still be routed
+LOCATION_FIELDS = ('latitude', 'longitude', 'state', 'district')
+
+
+def state_room(state):
+    return f"state:{state}"
+
+
+def district_room(state, district):
+    return f"district:{state}:{district}"
+
+
+FLEET_ROOM = 'fleet'
+
+
+# Subscriptions of all workers, kept in a shared Redis, so whichever worker ingests a change can
+# route it to clients connected elsewhere. Each worker keeps its own subscriber count per room
+# and bbox per sid under keys named after it, with a TTL that its heartbeat() refreshes while
+# republishing them; the subscriptions of a worker that dies expire with it. snapshot() merges
+# the workers that have beaten within the TTL, read back at most once per `refresh` seconds.
+class SharedSubscriptions:
+    def __init__(self, client, worker, prefix='live', refresh=1.0, ttl=30.0):
+        self.client = client
+        self.worker = worker
+        self.prefix = prefix
+        self.workers_key = f"{prefix}:workers"  # sorted set: worker -> time of its last heartbeat
+        self.rooms_key = self._rooms_key(worker)
+        self.bboxes_key = self._bboxes_key(worker)
+        self.refresh = refresh
+        self.ttl = ttl
+        self._snapshot = (set(), {})
+        self._read_at = 0.0
+        self._beat_at = 0.0
+
+    def _rooms_key(self, worker):
+        return f"{self.prefix}:rooms:{worker}"
+
+    def _bboxes_key(self, worker):
+        return f"{self.prefix}:bboxes:{worker}"
+
+    # Queue the writes that keep this worker's keys alive and visible to snapshot()
+    def _keep_alive(self, pipe):
+        pipe.pexpire(self.rooms_key, int(self.ttl * 1000))
+        pipe.pexpire(self.bboxes_key, int(self.ttl * 1000))
+        pipe.zadd(self.workers_key, {self.worker: time.time()})
+
+    def add_room(self, room):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(self.rooms_key, room, 1)
+        self._keep_alive(pipe)
+        pipe.execute()
+
+    def remove_room(self, room):
+        if self.client.hincrby(self.rooms_key, room, -1) <= 0:
+            self.client.hdel(self.rooms_key, room)
+
+    def set_bbox(self, sid, bbox):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self.bboxes_key, sid, json.dumps(bbox))
+        self._keep_alive(pipe)
+        pipe.execute()
+
+    def remove_bbox(self, sid):
+        self.client.hdel(self.bboxes_key, sid)
+
+    # Replace this worker's keys with its current subscriptions ({room: count}, {sid: bbox}) and
+    # refresh their TTL; called every flush interval, writes at most every ttl / 3 seconds
+    def heartbeat(self, rooms, bboxes):
+        now = time.monotonic()
+        if now - self._beat_at < self.ttl / 3:
+            return
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self.rooms_key, self.bboxes_key)
+        if rooms:
+            pipe.hset(self.rooms_key, mapping=rooms)
+        if bboxes:
+            pipe.hset(self.bboxes_key, mapping={sid: json.dumps(bbox) for sid, bbox in bboxes.items()})
+        self._keep_alive(pipe)
+        pipe.execute()
+        self._beat_at = now
+
+    # (rooms with subscribers, {sid: bbox}) across all live workers
+    def snapshot(self):
+        if time.monotonic() - self._read_at >= self.refresh:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zremrangebyscore(self.workers_key, '-inf', time.time() - self.ttl)
+            pipe.zrange(self.workers_key, 0, -1)
+            workers = pipe.execute()[1]
+            pipe = self.client.pipeline(transaction=False)
+            for worker in workers:
+                pipe.hgetall(self._rooms_key(worker))
+                pipe.hgetall(self._bboxes_key(worker))
+            results = pipe.execute() if workers else []
+            rooms, bboxes = set(), {}
+            for worker_rooms, worker_bboxes in zip(results[::2], results[1::2]):
+                rooms.update(room for room, count in worker_rooms.items() if int(count) > 0)
+                bboxes.update((sid, tuple(json.loads(bbox))) for sid, bbox in worker_bboxes.items())
+            self._snapshot = (rooms, bboxes)
+            self._read_at = time.monotonic()
+        return self._snapshot
+
+
+# Room-scoped, coalesced Socket.IO push.
+#
+# Clients subscribe to the whole fleet, a state, a district or a viewport bounding box.
+# Position and status changes are merged per device in memory and sent every `interval`
+# seconds as one 'terminal_delta' event per room that has subscribers, so each change is sent
+# at most once per interval and only to the clients that asked for that area. A device that
+# moves out of an area is still reported to that area once, so its subscribers can drop it.
+#
+# With several workers, pass `shared` (SharedSubscriptions) and a Socket.IO message queue:
+# every worker then routes its own changes using everyone's subscriptions.
+class LiveUpdateHub:
+    def __init__(self, socketio, interval=1.0, shared=None):
+        self.socketio = socketio
+        self.interval = interval
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._pending = {}  # device_id -> merged changes since the last flush
+        self._last = {}  # device_id -> last known location fields
+        self._room_members = defaultdict(set)  # room -> sids
+        self._sid_rooms = defaultdict(set)  # sid -> rooms
+        self._bboxes = {}  # sid -> (min_lon, min_lat, max_lon, max_lat)
+        self._task = None
+
+    # Room for a subscription request: {} (whole fleet), {'state'}, {'state', 'district'} or {'bbox'}
+    def subscribe(self, sid, request):
+        request = request or {}
+        bbox = request.get('bbox')
+        new_room = False
+        with self._lock:
+            if bbox is not None:
+                bbox = tuple(float(v) for v in bbox)
+                if len(bbox) != 4:
+                    raise ValueError('bbox must be [min_lon, min_lat, max_lon, max_lat]')
+                self._bboxes[sid] = bbox
+                room = None
+            elif request.get('state') and request.get('district'):
+                room = district_room(request['state'], request['district'])
+            elif request.get('state'):
+                room = state_room(request['state'])
+            else:
+                room = FLEET_ROOM
+            if room:
+                new_room = sid not in self._room_members[room]
+                self._room_members[room].add(sid)
+                self._sid_rooms[sid].add(room)
+        if self.shared:
+            try:
+                if room is None:
+                    self.shared.set_bbox(sid, bbox)
+                elif new_room:
+                    self.shared.add_room(room)
+            except Exception as e:
+                logging.warning(f"Shared subscription update failed: {e}")
+        self._ensure_running()
+        return room
+
+    # Drop one room (or the bbox subscription when room is None), or everything when everything=True
+    def unsubscribe(self, sid, room=None, everything=False):
+        left = []
+        with self._lock:
+            rooms = set(self._sid_rooms.get(sid, ())) if everything else ({room} if room else set())
+            for r in rooms:
+                members = self._room_members.get(r)
+                if members is not None:
+                    if sid in members:
+                        left.append(r)
+                    members.discard(sid)
+                    if not members:
+                        del self._room_members[r]
+                self._sid_rooms[sid].discard(r)
+            had_bbox = (everything or room is None) and self._bboxes.pop(sid, None) is not None
+            if not self._sid_rooms.get(sid):
+                self._sid_rooms.pop(sid, None)
+        if self.shared:
+            try:
+                for r in left:
+                    self.shared.remove_room(r)
+                if had_bbox:
+                    self.shared.remove_bbox(sid)
+            except Exception as e:
+                logging.warning(f"Shared subscription update failed: {e}")
+        return rooms
+
+    # Record a change for a device; later changes in the same interval overwrite earlier ones
+    def push(self, device_id, **fields):
+        with self._lock:
+            update = self._pending.setdefault(device_id, {'device_id': device_id})
+            previous = self._last.get(device_id)
+            if previous and '_previous' not in update:
+                update['_previous'] = dict(previous)
+            update.update(fields)
+            location = {k: fields[k] for k in LOCATION_FIELDS if fields.get(k) is not None}
+            if location:
+                self._last.setdefault(device_id, {}).update(location)
+        # Other workers' clients may be subscribed, so flush even without local subscribers
+        if self.shared:
+            self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            self.flush()
+            if self.shared:
+                self._heartbeat()
+
+    def _heartbeat(self):
+        with self._lock:
+            rooms = {room: len(members) for room, members in self._room_members.items() if members}
+            bboxes = dict(self._bboxes)
+        try:
+            self.shared.heartbeat(rooms, bboxes)
+        except Exception as e:
+            logging.warning(f"Shared subscription heartbeat failed: {e}")
+
+    def _rooms_for(self, location):
+        rooms = []
+        state, district = location.get('state'), location.get('district')
+        if state:
+            rooms.append(state_room(state))
+            if district:
+                rooms.append(district_room(state, district))
+        return rooms
+
+    # Emit one delta batch per interested room / bbox subscriber; returns the number of events sent
+    def flush(self):
+        if not self._pending:
+            return 0
+        shared = None
+        if self.shared:
+            try:
+                shared = self.shared.snapshot()
+            except Exception as e:
+                logging.warning(f"Shared subscriptions unavailable, routing to local subscribers only: {e}")
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            if shared is not None:
+                active_rooms, bboxes = shared
+            else:
+                active_rooms = {room for room, members in self._room_members.items() if members}
+                bboxes = dict(self._bboxes)
+            updates = []
+            previous_positions = []
+            by_room = defaultdict(list)
+            for device_id, update in pending.items():
+                previous = update.pop('_previous', None) or {}
+                location = self._last.get(device_id, {})
+                for key in LOCATION_FIELDS:
+                    update.setdefault(key, location.get(key))
+                updates.append(update)
+                previous_positions.append((previous.get('latitude'), previous.get('longitude')))
+                rooms = set(self._rooms_for(location)) | set(self._rooms_for(previous))
+                for room in rooms & active_rooms:
+                    by_room[room].append(update)
+                if FLEET_ROOM in active_rooms:
+                    by_room[FLEET_ROOM].append(update)
+
+        sent = 0
+        for room, room_updates in by_room.items():
+            self.socketio.emit('terminal_delta', {'room': room, 'terminals': room_updates}, to=room)
+            sent += 1
+
+        # Viewport subscribers: one vectorized containment test per bbox, on current and previous positions
+        if bboxes:
+            lats, lons = self._coordinates((u.get('latitude'), u.get('longitude')) for u in updates)
+            prev_lats, prev_lons = self._coordinates(previous_positions)
+            for sid, (min_lon, min_lat, max_lon, max_lat) in bboxes.items():
+                mask = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+                mask |= (prev_lons >= min_lon) & (prev_lons <= max_lon) & (prev_lats >= min_lat) & (prev_lats <= max_lat)
+                if mask.any():
+                    self.socketio.emit('terminal_delta', {
+                        'room': 'bbox',
+                        'terminals': [updates[i] for i in np.nonzero(mask)[0]],
+                    }, to=sid)
+                    sent += 1
+        return sent
+
+    # Arrays of latitudes/longitudes with NaN for unknown positions (NaN never falls inside a bbox)
+    @staticmethod
+    def _coordinates(pairs):
+        pairs = [(np.nan if lat is None else lat, np.nan if lon is None else lon) for lat, lon in pairs]
+        coords = np.array(pairs, dtype=float).reshape(-1, 2)
+        return coords[:, 0], coords[:, 1]
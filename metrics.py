@@ -0,0 +1,158 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond geometry work up to slow requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# Minimal Prometheus-style metric types (text exposition format 0.0.4), so the app does not
+# need prometheus_client. Label values are passed as keyword arguments.
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function  # optional callable returning the current value (unlabelled)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _render_samples(self, items):
+        if self.function is not None:
+            # A failing callback only costs its own sample, not the whole exposition
+            try:
+                items = [((), self.function())]
+            except Exception as e:
+                logging.warning(f"Gauge {self.name} callback failed: {e}")
+                items = []
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    # Context manager timing its block
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    # Wrap a callable so every call is timed
+    def wrap(self, function, **labels):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.time(**labels):
+                return function(*args, **kwargs)
+        return timed
+
+    def _render_samples(self, items):
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', repr(bound))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+
+
+# Text exposition of every registered metric
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics shared by the app's instrumentation
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route', ('endpoint', 'method', 'status'))
+SQL_STATEMENT_SECONDS = Histogram('sql_statement_duration_seconds', 'SQL statement latency by statement type', ('statement',))
+SQL_STATEMENTS_PER_REQUEST = Histogram(
+    'sql_statements_per_request', 'SQL statements issued per request', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000),
+)
+SQL_SECONDS_PER_REQUEST = Histogram('sql_time_per_request_seconds', 'Total SQL time per request', ('endpoint',))
+TILE38_SECONDS = Histogram('tile38_command_duration_seconds', 'Tile38 command latency', ('command',))
+MQTT_PUBLISH_SECONDS = Histogram('mqtt_publish_duration_seconds', 'Time spent in MQTT publish calls')
+SOCKETIO_EMIT_SECONDS = Histogram('socketio_emit_duration_seconds', 'Time spent in Socket.IO emits', ('event',))
+GEOMETRY_SECONDS = Histogram('geometry_operation_duration_seconds', 'Shapely / NumPy geometry work', ('operation',))
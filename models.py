@@ -17,6 +17,10 @@ class TerminalData(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     district = db.Column(db.String(255), nullable=False)
     state = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_terminal_data_device_id_timestamp', device_id, timestamp.desc(), id.desc()),
+    )
     
     def __repr__(self):
         return f"<TerminalData {self.device_id}>"
@@ -38,9 +42,13 @@ class Terminal(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     device_id = db.Column(db.String(255), nullable=False, unique=True)
     name = db.Column(db.String(255), nullable=False)
+    sai = db.Column(db.Integer, nullable=True)
     last_latitude = db.Column(db.Float, nullable=True)
     last_longitude = db.Column(db.Float, nullable=True)
     last_timestamp = db.Column(db.DateTime, nullable=True)
+    district = db.Column(db.String(255), nullable=True)
+    state = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=True)
     
     def __repr__(self):
         return f"<Terminal {self.device_id}>"
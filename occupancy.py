@@ -0,0 +1,96 @@
+import threading
+
+
+def _is_active(status):
+    return (status or 'active').lower() == 'active'
+
+
+# Live active/inactive terminal counts per district, per state and for the whole fleet.
+#
+# Counts are adjusted when a device changes area or status instead of being recounted, so
+# reading any count is a dictionary lookup. Devices without a known area only count towards
+# the fleet totals.
+class OccupancyCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}  # device_id -> (state, district, active)
+        self._districts = {}  # state -> district -> [active, inactive]
+        self._states = {}  # state -> [active, inactive]
+        self._fleet = [0, 0]
+        self.version = 0  # bumped on every change of a count
+
+    # Merge a change for one device; fields left out (or None) keep their previous value
+    def update(self, device_id, status=None, state=None, district=None, **_):
+        with self._lock:
+            previous = self._devices.get(device_id)
+            if previous is None:
+                current = (state, district, _is_active(status))
+            else:
+                current = (
+                    state if state is not None else previous[0],
+                    district if district is not None else previous[1],
+                    previous[2] if status is None else _is_active(status),
+                )
+            if current == previous:
+                return
+            if previous is not None:
+                self._add(previous, -1)
+            self._add(current, 1)
+            self._devices[device_id] = current
+            self.version += 1
+
+    def _add(self, entry, sign):
+        state, district, active = entry
+        column = 0 if active else 1
+        self._fleet[column] += sign
+        if state is None:
+            return
+        totals = self._states.setdefault(state, [0, 0])
+        totals[column] += sign
+        districts = self._districts.setdefault(state, {})
+        counts = districts.setdefault(district, [0, 0])
+        counts[column] += sign
+        if counts == [0, 0]:
+            del districts[district]
+        if totals == [0, 0]:
+            del self._states[state], self._districts[state]
+
+    def __len__(self):
+        return len(self._devices)
+
+    def fleet(self):
+        with self._lock:
+            return _counts(self._fleet)
+
+    def state(self, state):
+        with self._lock:
+            return _counts(self._states.get(state, (0, 0)))
+
+    def district(self, state, district):
+        with self._lock:
+            return _counts(self._districts.get(state, {}).get(district, (0, 0)))
+
+    # {state: {'active', 'inactive', 'total', 'districts': {district: counts}}}, for one state or all
+    def breakdown(self, state=None):
+        with self._lock:
+            states = [state] if state is not None else sorted(self._states)
+            return {s: dict(_counts(self._states.get(s, (0, 0))), districts={
+                d: _counts(c) for d, c in sorted(self._districts.get(s, {}).items(), key=lambda item: str(item[0]))
+            }) for s in states}
+
+    # (state, district, active, inactive) rows: the fleet as (None, None), each state as
+    # (state, None) and each district
+    def rows(self):
+        with self._lock:
+            rows = [(None, None, *self._fleet)]
+            for state in sorted(self._states):
+                rows.append((state, None, *self._states[state]))
+                rows.extend((state, district, *counts) for district, counts in
+                            sorted(self._districts[state].items(), key=lambda item: str(item[0]))
+                            if district is not None)
+            return rows
+
+
+def _counts(counts):
+    active, inactive = counts
+    return {'active': active, 'inactive': inactive, 'total': active + inactive}
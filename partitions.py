@@ -0,0 +1,353 @@
+import argparse
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+# Partitioning policy for terminal_data; see maintain()
+PARTITION_INTERVAL = os.getenv('TERMINAL_DATA_PARTITION_INTERVAL', 'day')  # 'day' or 'week'
+RETENTION_DAYS = int(os.getenv('TERMINAL_DATA_RETENTION_DAYS', 90))
+ROLLUP_RETENTION_DAYS = int(os.getenv('TERMINAL_DATA_ROLLUP_RETENTION_DAYS', 730))
+PARTITIONS_AHEAD = int(os.getenv('TERMINAL_DATA_PARTITIONS_AHEAD', 7))
+
+ROLLUP_TABLE = 'terminal_data_hourly'
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+# Per-device hourly summaries of terminal_data, maintained by rollup_hours()
+CREATE_ROLLUP_SQL = f"""
+CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+    device_id TEXT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    samples INT NOT NULL,
+    latitude FLOAT,
+    longitude FLOAT,
+    last_latitude FLOAT,
+    last_longitude FLOAT,
+    first_timestamp TIMESTAMP,
+    last_timestamp TIMESTAMP,
+    district TEXT,
+    state TEXT,
+    avg_rx_esno FLOAT,
+    avg_tx_esno FLOAT,
+    PRIMARY KEY (device_id, hour)
+);
+"""
+
+# Recomputes whole hours, so re-running over an already rolled-up hour picks up late fixes
+ROLLUP_SQL = f"""
+INSERT INTO {ROLLUP_TABLE} (
+    device_id, hour, samples, latitude, longitude, last_latitude, last_longitude,
+    first_timestamp, last_timestamp, district, state, avg_rx_esno, avg_tx_esno
+)
+SELECT
+    device_id,
+    date_trunc('hour', timestamp) AS hour,
+    count(*),
+    avg(latitude),
+    avg(longitude),
+    (array_agg(latitude ORDER BY timestamp DESC))[1],
+    (array_agg(longitude ORDER BY timestamp DESC))[1],
+    min(timestamp),
+    max(timestamp),
+    (array_agg(district ORDER BY timestamp DESC))[1],
+    (array_agg(state ORDER BY timestamp DESC))[1],
+    avg(rx_esno),
+    avg(tx_esno)
+FROM {{table}}
+WHERE timestamp >= %s AND timestamp < %s
+GROUP BY device_id, date_trunc('hour', timestamp)
+ON CONFLICT (device_id, hour) DO UPDATE SET
+    samples = EXCLUDED.samples,
+    latitude = EXCLUDED.latitude,
+    longitude = EXCLUDED.longitude,
+    last_latitude = EXCLUDED.last_latitude,
+    last_longitude = EXCLUDED.last_longitude,
+    first_timestamp = EXCLUDED.first_timestamp,
+    last_timestamp = EXCLUDED.last_timestamp,
+    district = EXCLUDED.district,
+    state = EXCLUDED.state,
+    avg_rx_esno = EXCLUDED.avg_rx_esno,
+    avg_tx_esno = EXCLUDED.avg_tx_esno;
+"""
+
+
+# Start of the partition containing `moment`; weekly partitions start on Monday
+def partition_start(moment, interval=PARTITION_INTERVAL):
+    day = datetime(moment.year, moment.month, moment.day)
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def partition_step(interval=PARTITION_INTERVAL):
+    return timedelta(weeks=1) if interval == 'week' else timedelta(days=1)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y%m%d}"
+
+
+# 'r' for a plain table, 'p' for a partitioned one, None when it does not exist
+def table_kind(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# [(name, lower, upper)] for the range partitions of `table`; MINVALUE/MAXVALUE bounds are None
+def list_partitions(cursor, table):
+    cursor.execute("""
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = _BOUND_RE.search(bound or '')
+        if not match:
+            continue  # the DEFAULT partition
+        lower, upper = (None if 'VALUE' in b else datetime.fromisoformat(b.strip("'")) for b in match.groups())
+        partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda p: p[2] or datetime.max)
+
+
+# {column: (type, collation or None)} of a table's live columns, names and collations quoted
+def table_columns(cursor, table):
+    cursor.execute("""
+        SELECT quote_ident(a.attname), format_type(a.atttypid, a.atttypmod),
+               CASE WHEN a.attcollation <> t.typcollation THEN quote_ident(c.collname) END
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_collation c ON c.oid = a.attcollation
+        WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+    """, (table,))
+    return {name: (type_, collation) for name, type_, collation in cursor.fetchall()}
+
+
+def _column_sql(type_, collation):
+    return f"{type_} COLLATE {collation}" if collation else type_
+
+
+# Make a table that is about to be attached as a partition match the columns of its parent:
+# columns only the parent has are added to the table, columns only the table has (e.g. ones
+# created by app.py's db.create_all()) are added to the still empty parent, and differing types
+# or collations are converted to the parent's
+def align_columns(cursor, parent, table):
+    parent_columns, columns = table_columns(cursor, parent), table_columns(cursor, table)
+    for name, definition in parent_columns.items():
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {_column_sql(*definition)}")
+        elif columns[name] != definition:
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {name} TYPE {_column_sql(*definition)} "
+                           f"USING {name}::{definition[0]}")
+    for name, definition in columns.items():
+        if name not in parent_columns:
+            cursor.execute(f"ALTER TABLE {parent} ADD COLUMN {name} {_column_sql(*definition)}")
+
+
+# Create `table` range-partitioned on timestamp, converting an existing plain table in place.
+#
+# `columns_sql` is the column list of the table. A plain table is renamed to <table>_legacy and
+# attached as the partition for everything before the first boundary after its newest row, so
+# no rows are copied and the legacy data is dropped by retention like any other partition. Its
+# columns are aligned with the new table first (see align_columns), and its id sequence is
+# handed over to the new table so ids keep increasing.
+def ensure_partitioned_table(cursor, table, columns_sql, interval=PARTITION_INTERVAL):
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"partition:{table}",))
+    kind = table_kind(cursor, table)
+    if kind == 'p':
+        return False
+
+    create_sql = f"""
+        CREATE TABLE {table} (
+            {columns_sql},
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;
+    """
+    if kind is None:
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq")
+        cursor.execute(create_sql)
+        cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        return True
+
+    legacy = f"{table}_legacy"
+    cursor.execute(f"SELECT max(timestamp) FROM {table}")
+    newest = cursor.fetchone()[0] or datetime.utcnow()
+    boundary = partition_start(newest, interval) + partition_step(interval)
+    logging.info(f"Converting {table} to a partitioned table; existing rows become partition {legacy}")
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    cursor.execute(f"ALTER TABLE {legacy} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(f"ALTER TABLE {legacy} ALTER COLUMN timestamp SET NOT NULL")
+    cursor.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT IF EXISTS {table}_pkey")
+    cursor.execute(f"ALTER INDEX IF EXISTS ix_{table}_device_id_timestamp RENAME TO ix_{legacy}_device_id_timestamp")
+    cursor.execute(create_sql)
+    cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    align_columns(cursor, table, legacy)
+    cursor.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)", (boundary,)
+    )
+    return True
+
+
+# Create one range partition. Rows for its range that landed in the DEFAULT partition (while
+# maintenance was not running) would make CREATE ... PARTITION OF fail, so when there are any
+# the partition is created standalone, the rows are moved into it and it is then attached,
+# all in the caller's transaction.
+def create_partition(cursor, table, name, start, end):
+    default = f"{table}_default"
+    stranded = False
+    if table_kind(cursor, default):
+        cursor.execute(f"SELECT 1 FROM {default} WHERE timestamp >= %s AND timestamp < %s LIMIT 1", (start, end))
+        stranded = cursor.fetchone() is not None
+    if not stranded:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", (start, end)
+        )
+        return
+    logging.info(f"Moving rows from {start} to {end} out of {default} into new partition {name}")
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"""
+        WITH moved AS (DELETE FROM {default} WHERE timestamp >= %s AND timestamp < %s RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+
+
+# Create the partitions covering now .. now + `ahead` intervals; returns the names created.
+# Gaps left while nothing was running are filled, but never further back than `not_before`.
+def ensure_partitions(cursor, table, now=None, ahead=PARTITIONS_AHEAD, interval=PARTITION_INTERVAL, not_before=None):
+    now = now or datetime.utcnow()
+    step = partition_step(interval)
+    existing = list_partitions(cursor, table)
+    covered_until = max((upper for _, _, upper in existing if upper), default=None)
+
+    start = partition_start(now, interval)
+    if covered_until and covered_until < start:
+        start = max(covered_until, partition_start(not_before, interval)) if not_before else covered_until
+    elif covered_until:
+        start = covered_until
+    end = partition_start(now, interval) + step * (ahead + 1)
+
+    created = []
+    while start < end:
+        name = partition_name(table, start)
+        create_partition(cursor, table, name, start, start + step)
+        created.append(name)
+        start += step
+    return created
+
+
+# Drop whole partitions whose upper bound is at or before `cutoff`; returns the names dropped
+def drop_expired_partitions(cursor, table, cutoff):
+    dropped = []
+    for name, _, upper in list_partitions(cursor, table):
+        if upper and upper <= cutoff:
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return dropped
+
+
+# Roll up closed hours since the last rolled-up hour (re-doing that one); returns (since, until)
+def rollup_hours(cursor, table, now=None, not_before=None):
+    now = now or datetime.utcnow()
+    until = now.replace(minute=0, second=0, microsecond=0)
+    cursor.execute(CREATE_ROLLUP_SQL)
+    cursor.execute(f"SELECT max(hour) FROM {ROLLUP_TABLE}")
+    since = cursor.fetchone()[0] or not_before
+    if since is None:
+        cursor.execute(f"SELECT min(timestamp) FROM {table}")
+        since = cursor.fetchone()[0] or until
+    since = since.replace(minute=0, second=0, microsecond=0)
+    if since < until:
+        cursor.execute(ROLLUP_SQL.format(table=table), (since, until))
+    return since, until
+
+
+# One maintenance pass: create upcoming partitions, roll up finished hours, then apply
+# retention. Rollups run before partitions are dropped, so no hour is lost to retention.
+def maintain(connection, table='terminal_data', now=None, interval=PARTITION_INTERVAL,
+             retention_days=RETENTION_DAYS, rollup_retention_days=ROLLUP_RETENTION_DAYS, ahead=PARTITIONS_AHEAD):
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+    try:
+        with connection.cursor() as cursor:
+            created = ensure_partitions(cursor, table, now, ahead, interval, not_before=cutoff)
+            since, until = rollup_hours(cursor, table, now, not_before=cutoff)
+            dropped = drop_expired_partitions(cursor, table, cutoff)
+            cursor.execute(
+                f"DELETE FROM {ROLLUP_TABLE} WHERE hour < %s", (now - timedelta(days=rollup_retention_days),)
+            )
+            rollups_expired = cursor.rowcount
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    summary = {
+        'partitions_created': created,
+        'partitions_dropped': dropped,
+        'rolled_up_from': since.isoformat(),
+        'rolled_up_to': until.isoformat(),
+        'rollups_expired': rollups_expired,
+    }
+    logging.info(f"terminal_data maintenance: {summary}")
+    return summary
+
+
+# Runs maintain() every `every` seconds on its own connection, off the ingest path
+class PartitionMaintainer:
+    def __init__(self, connect, every=3600.0, **policy):
+        self.connect = connect  # returns a connected genData.DatabaseManager
+        self.every = every
+        self.policy = policy
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        manager = self.connect()
+        try:
+            while True:
+                try:
+                    maintain(manager.connection, **self.policy)
+                except Exception as e:
+                    logging.error(f"terminal_data maintenance failed: {e}")
+                if self._stopped.wait(self.every):
+                    break
+        finally:
+            manager.close()
+
+
+# Run one maintenance pass, e.g. from cron: python partitions.py
+if __name__ == '__main__':
+    from genData import DB_CONFIG, DatabaseManager
+
+    parser = argparse.ArgumentParser(description='Create, roll up and expire terminal_data partitions')
+    parser.add_argument('--interval', choices=['day', 'week'], default=PARTITION_INTERVAL)
+    parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS)
+    parser.add_argument('--rollup-retention-days', type=int, default=ROLLUP_RETENTION_DAYS)
+    parser.add_argument('--ahead', type=int, default=PARTITIONS_AHEAD, help='Partitions to create in advance')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_manager = DatabaseManager(DB_CONFIG)
+    db_manager.connect()
+    try:
+        print(maintain(
+            db_manager.connection, interval=args.interval, retention_days=args.retention_days,
+            rollup_retention_days=args.rollup_retention_days, ahead=args.ahead,
+        ))
+    finally:
+        db_manager.close()
@@ -0,0 +1,91 @@
+import sys
+import threading
+from collections import Counter
+
+
+# Opt-in sampling profiler for a single route.
+#
+# enable() arms it for the next `requests` requests to one endpoint. While such a request runs,
+# a sampler thread records the request thread's stack every `interval` seconds; the samples
+# are aggregated as collapsed stacks ("outer;inner;leaf count"), the input format of
+# flamegraph.pl and speedscope. Requests to other endpoints are not affected.
+class RouteProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoint = None
+        self._remaining = 0
+        self._interval = 0.005
+        self._stacks = Counter()
+        self._samples = 0
+        self._profiled = 0
+
+    def enable(self, endpoint, requests=10, interval=0.005):
+        with self._lock:
+            self._endpoint = endpoint
+            self._remaining = requests
+            self._interval = interval
+            self._stacks = Counter()
+            self._samples = 0
+            self._profiled = 0
+
+    def disable(self):
+        with self._lock:
+            self._endpoint = None
+            self._remaining = 0
+
+    # Start sampling the calling thread if it serves the armed endpoint; returns a session to stop
+    def start(self, endpoint):
+        with self._lock:
+            if endpoint is None or endpoint != self._endpoint or self._remaining <= 0:
+                return None
+            self._remaining -= 1
+            interval = self._interval
+        return _SamplingSession(self, threading.get_ident(), interval)
+
+    def _record(self, stacks):
+        with self._lock:
+            self._stacks.update(stacks)
+            self._samples += sum(stacks.values())
+            self._profiled += 1
+
+    def status(self):
+        with self._lock:
+            return {
+                'endpoint': self._endpoint,
+                'remaining_requests': self._remaining,
+                'interval': self._interval,
+                'profiled_requests': self._profiled,
+                'samples': self._samples,
+            }
+
+    def collapsed(self):
+        with self._lock:
+            return '\n'.join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + '\n'
+
+
+class _SamplingSession:
+    def __init__(self, profiler, thread_id, interval):
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self.profiler._record(self.stacks)
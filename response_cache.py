@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+
+
+# Serialized responses keyed by (name, *args), each with a strong ETag (SHA-1 of the body).
+#
+# Entries live for their TTL (None: until invalidated). Concurrent misses on the same key build
+# the body once. invalidate(name) drops every entry of that name; a build that was running while
+# its name was invalidated is returned to its caller but not stored, so a stale body cannot
+# outlive the invalidation.
+class ResponseCache:
+    def __init__(self):
+        self._entries = {}  # name -> {key: (body, etag, expires_at)}
+        self._generations = {}  # name -> invalidation count
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key[0], {}).get(key)
+        if entry is not None and (entry[2] is None or entry[2] > time.monotonic()):
+            return entry
+        return None
+
+    # (body, etag) for `key`, calling build() -> bytes on a miss
+    def get(self, key, build, ttl=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0], entry[1]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0], entry[1]
+                self.misses += 1
+                generation = self._generations.get(key[0], 0)
+            body = build()
+            etag = hashlib.sha1(body).hexdigest()
+            with self._lock:
+                if self._generations.get(key[0], 0) == generation:
+                    expires_at = time.monotonic() + ttl if ttl is not None else None
+                    self._entries.setdefault(key[0], {})[key] = (body, etag, expires_at)
+            return body, etag
+
+    def invalidate(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            self._entries.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': sum(len(entries) for entries in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
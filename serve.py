@@ -0,0 +1,52 @@
+import argparse
+import logging
+import multiprocessing
+import os
+
+from coordination import MESSAGE_QUEUE_URL
+
+
+# One worker: a separate process that imports app.py itself, so its MQTT, Tile38 and database
+# connections and its in-memory fleet state are its own
+def run_worker(host, port):
+    import app
+    app.socketio.run(app.app, host=host, port=port, allow_unsafe_werkzeug=True)
+
+
+# Run `--workers` app workers on consecutive ports starting at `--port`.
+#
+# Put a proxy in front that keeps each Socket.IO client on one worker (e.g. nginx ip_hash), or
+# have clients use the websocket transport only. MESSAGE_QUEUE_URL must point at a Redis server
+# shared by all workers (on every node): Socket.IO emits, live-update subscriptions and the
+# leases that keep background consumers on a single worker go through it.
+def main():
+    parser = argparse.ArgumentParser(description='Run several app workers behind a load balancer')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='Port of the first worker')
+    args = parser.parse_args()
+
+    if args.workers > 1 and not MESSAGE_QUEUE_URL:
+        parser.error('MESSAGE_QUEUE_URL must be set to run more than one worker')
+
+    logging.basicConfig(level=logging.INFO)
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=run_worker, args=(args.host, args.port + i), name=f"worker-{i}")
+        for i in range(args.workers)
+    ]
+    for i, worker in enumerate(workers):
+        worker.start()
+        logging.info(f"{worker.name} listening on {args.host}:{args.port + i}")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == '__main__':
+    main()
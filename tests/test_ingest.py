@@ -0,0 +1,96 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import IngestPipeline
+
+
+class BrokenConnection(Exception):
+    pass
+
+
+# Stands in for genData.DatabaseManager; `failures` is shared by every connection it makes
+class FakeDatabase:
+    def __init__(self, failures):
+        self.failures = failures
+        self.rows = []
+        self.pending = []
+        self.broken = False
+
+    def copy_rows(self, rows):
+        if self.failures.get('copy'):
+            self.failures['copy'] -= 1
+            self.broken = True
+            raise BrokenConnection('server closed the connection unexpectedly')
+        self.pending.extend(rows)
+
+    def upsert_latest_positions(self, records):
+        pass
+
+    def commit(self):
+        self.rows.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        if self.broken:
+            raise BrokenConnection('connection already closed')
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+class IngestPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.failures = {}
+
+    def connect(self):
+        if self.failures.get('connect'):
+            self.failures['connect'] -= 1
+            raise BrokenConnection('could not connect to server')
+        self.connections.append(FakeDatabase(self.failures))
+        return self.connections[-1]
+
+    def pipeline(self, **kwargs):
+        return IngestPipeline(self.connect, batch_size=2, report_interval=3600, retry_backoff=0.01, **kwargs)
+
+    def test_batch_is_retried_on_a_new_connection(self):
+        self.failures['copy'] = 1
+        pipeline = self.pipeline().start()
+        pipeline.submit_many([('a',), ('b',)])
+        pipeline.close()
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.connections[1].rows, [('a',), ('b',)])
+        self.assertEqual((pipeline.batches_written, pipeline.batches_failed), (1, 0))
+
+    def test_writer_reconnects_after_failed_connects(self):
+        self.failures['connect'] = 2
+        pipeline = self.pipeline().start()
+        pipeline.submit_many([('a',), ('b',)])
+        pipeline.close()
+        self.assertEqual(self.connections[0].rows, [('a',), ('b',)])
+
+    def test_batch_fails_after_its_attempts(self):
+        self.failures['copy'] = 2
+        pipeline = self.pipeline(attempts=2).start()
+        pipeline.submit_many([('a',), ('b',), ('c',), ('d',)])
+        pipeline.close()
+        self.assertEqual((pipeline.batches_written, pipeline.batches_failed), (1, 1))
+        self.assertEqual(self.connections[-1].rows, [('c',), ('d',)])
+
+    def test_submit_raises_without_a_writer(self):
+        pipeline = self.pipeline(max_in_flight=1, mirror=self.fail_mirror).start()
+        with self.assertLogs(level='ERROR'), self.assertRaises(RuntimeError):
+            for _ in range(10):
+                pipeline.submit_many([('a',), ('b',)])
+        pipeline.close()
+
+    def fail_mirror(self, batch):
+        raise OSError('disk full')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook_queue import WebhookQueue, WebhookWorkerPool
+
+
+class FakeQueue:
+    def __init__(self):
+        self.acked = []
+        self.released = []
+
+    def ack(self, ids):
+        self.acked.extend(ids)
+
+    def release(self, ids):
+        self.released.extend(ids)
+        return 0
+
+
+class WebhookWorkerPoolTest(unittest.TestCase):
+    def process(self, rows):
+        batches = []
+        queue = FakeQueue()
+        WebhookWorkerPool(queue, batches.append)._process(rows)
+        return batches[0], queue
+
+    def test_last_event_per_device_and_geofence_wins(self):
+        events, queue = self.process([
+            (1, 'T1', 'geofence:A:a1', 'enter'),
+            (2, 'T1', 'geofence:A:a1', 'exit'),
+            (3, 'T1', 'geofence:A:a1', 'enter'),
+        ])
+        self.assertEqual(events, [('T1', 'geofence:A:a1', 'enter')])
+        self.assertEqual(queue.acked, [1, 2, 3])
+
+    def test_events_follow_the_order_of_their_last_arrival(self):
+        events, _ = self.process([
+            (3, 'T1', 'geofence:A:a1', 'exit'),
+            (1, 'T1', 'geofence:A:a1', 'enter'),
+            (2, 'T2', 'geofence:A:a1', 'enter'),
+            (4, 'T1', 'geofence:B:b1', 'enter'),
+        ])
+        self.assertEqual(events, [
+            ('T2', 'geofence:A:a1', 'enter'),
+            ('T1', 'geofence:A:a1', 'exit'),
+            ('T1', 'geofence:B:b1', 'enter'),
+        ])
+
+    def test_enter_exit_enter_through_the_queue(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            queue = WebhookQueue(os.path.join(workdir, 'queue.db'))
+            for i, detect in enumerate(('enter', 'exit', 'enter')):
+                queue.put('T1', 'geofence:A:a1', detect, str(i))
+            batches = []
+            WebhookWorkerPool(queue, batches.append)._process(queue.claim(wait=0))
+            self.assertEqual(batches, [[('T1', 'geofence:A:a1', 'enter')]])
+            self.assertEqual(queue.stats()['depth'], 0)
+            queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import logging
+import os
+from urllib.parse import quote
+
+from redis import Redis
+
+from tile38_pool import FLEET_COLLECTION, TILE38_URL
+
+# Collection holding the district polygons (the one Tile38StatusResolver intersects); the enter/
+# exit hooks watch FLEET_COLLECTION, which Tile38StatusResolver fills with every fix it checks
+GEOFENCE_COLLECTION = os.getenv('TILE38_GEOFENCE_COLLECTION', 'geofences')
+
+# Base URL Tile38 posts hook events to; the geofence key is appended
+WEBHOOK_URL = os.getenv('GEOFENCE_WEBHOOK_URL', 'http://localhost:5000/api/geofence_webhook')
+
+
+# Key used by the webhook route, the in-process engine and dashboard deltas
+def geofence_key(state, district):
+    return f"geofence:{state}:{district}"
+
+
+# Object id in GEOFENCE_COLLECTION
+def object_id(state, district):
+    return f"{state}_{district}"
+
+
+def hook_name(state, district):
+    return f"hook:{state}:{district}"
+
+
+# Geofence polygons and their enter/exit hooks in Tile38.
+#
+# Every write is sent as one pipelined batch (no MULTI), so fencing a whole state costs one
+# round-trip instead of two per district. Each hook references its polygon with GET instead of
+# repeating it inline, so a polygon is sent to Tile38 (and written to its AOF) only once.
+# reconcile() compares Tile38 with the geofences table and repairs any drift in bulk.
+class Tile38Geofences:
+    def __init__(self, url=TILE38_URL, collection=GEOFENCE_COLLECTION, fleet_collection=FLEET_COLLECTION,
+                 webhook_url=WEBHOOK_URL, timeout=5.0, scan_limit=1000):
+        self.url = url
+        self.collection = collection
+        self.fleet_collection = fleet_collection
+        self.webhook_url = webhook_url.rstrip('/')
+        self.timeout = timeout
+        self.scan_limit = scan_limit
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = Redis.from_url(
+                self.url, protocol=2, decode_responses=True,
+                socket_timeout=self.timeout, socket_connect_timeout=self.timeout,
+            )
+        return self._redis
+
+    def _set_commands(self, pipe, state, district, geojson):
+        pipe.execute_command('SET', self.collection, object_id(state, district), 'OBJECT', geojson)
+        pipe.execute_command(
+            'SETHOOK', hook_name(state, district), f"{self.webhook_url}/{quote(geofence_key(state, district), safe='')}",
+            'WITHIN', self.fleet_collection, 'FENCE', 'DETECT', 'enter,exit',
+            'GET', self.collection, object_id(state, district),
+        )
+
+    # Run a pipeline; returns the (command, error) pairs of the commands that failed
+    @staticmethod
+    def _execute(pipe):
+        commands = [' '.join(str(a) for a in args[:3]) for args, _ in pipe.command_stack]
+        replies = pipe.execute(raise_on_error=False)
+        return [(command, str(reply)) for command, reply in zip(commands, replies) if isinstance(reply, Exception)]
+
+    # fences: iterable of (state, district, geojson); SET each polygon and its hook in one batch
+    def put_many(self, fences):
+        pipe = self._client().pipeline(transaction=False)
+        for state, district, geojson in fences:
+            self._set_commands(pipe, state, district, geojson)
+        return self._execute(pipe) if pipe.command_stack else []
+
+    # areas: iterable of (state, district); delete each polygon and its hook in one batch
+    def delete_many(self, areas):
+        pipe = self._client().pipeline(transaction=False)
+        for state, district in areas:
+            pipe.execute_command('DEL', self.collection, object_id(state, district))
+            pipe.execute_command('DELHOOK', hook_name(state, district))
+        return self._execute(pipe) if pipe.command_stack else []
+
+    # Ids of every object in the geofence collection
+    def object_ids(self):
+        ids, cursor = set(), 0
+        while True:
+            reply = self._client().execute_command(
+                'SCAN', self.collection, 'CURSOR', cursor, 'LIMIT', self.scan_limit, 'IDS'
+            )
+            cursor, page = int(reply[0]), reply[1]
+            ids.update(page)
+            if not cursor:
+                return ids
+
+    # Names of the geofence hooks
+    def hook_names(self):
+        return {hook[0] for hook in self._client().execute_command('HOOKS', 'hook:*')}
+
+    # Make Tile38 match `areas` ((state, district) pairs of the geofences table): add missing
+    # polygons and hooks, remove ones without a geofence row. geojson(state, district) is only
+    # called for the polygons that have to be (re)written. Returns what was repaired.
+    def reconcile(self, areas, geojson):
+        expected_ids = {object_id(s, d): (s, d) for s, d in areas}
+        expected_hooks = {hook_name(s, d): (s, d) for s, d in areas}
+        present_ids = self.object_ids()
+        present_hooks = self.hook_names()
+
+        missing = {expected_ids[i] for i in expected_ids.keys() - present_ids}
+        missing |= {expected_hooks[h] for h in expected_hooks.keys() - present_hooks}
+        stray_ids = present_ids - expected_ids.keys()
+        stray_hooks = present_hooks - expected_hooks.keys()
+
+        pipe = self._client().pipeline(transaction=False)
+        for state, district in sorted(missing):
+            self._set_commands(pipe, state, district, geojson(state, district))
+        for stray in sorted(stray_ids):
+            pipe.execute_command('DEL', self.collection, stray)
+        for stray in sorted(stray_hooks):
+            pipe.execute_command('DELHOOK', stray)
+        errors = self._execute(pipe) if pipe.command_stack else []
+        for command, error in errors:
+            logging.error(f"Tile38 reconciliation: {command} failed: {error}")
+        return {
+            'added': sorted(f"{s}/{d}" for s, d in missing),
+            'removed_objects': sorted(stray_ids),
+            'removed_hooks': sorted(stray_hooks),
+            'errors': len(errors),
+        }
+
+    def close(self):
+        if self._redis is not None:
+            self._redis.close()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from redis.asyncio import Redis
+
+TILE38_URL = os.getenv('TILE38_URL', 'redis://localhost:9851')
+
+# Collection of tracked device positions that the geofence enter/exit hooks watch
+FLEET_COLLECTION = os.getenv('TILE38_FLEET_COLLECTION', 'fleet')
+
+# Half-width of the box tested around each fix, in degrees (matches the original per-point query)
+POINT_MARGIN = 0.0001
+
+
+# JSON reply of a pipelined command, or None for an error or a malformed reply
+def _response(reply):
+    try:
+        return json.loads(reply)
+    except (TypeError, ValueError):
+        return None
+
+
+def _ok(reply):
+    response = _response(reply)
+    return bool(response and response.get('ok'))
+
+
+# Resolves geofence status for many points at once against Tile38.
+#
+# A single connection pool is shared across ticks. Each batch is split into chunks; every chunk
+# is sent as one pipelined exchange (no MULTI) and the chunks run concurrently, so a tick costs
+# roughly one round-trip per chunk instead of one connection plus one round-trip per terminal.
+# The same exchange SETs each point into `fleet_collection` (None to skip), which is what fires
+# the enter/exit hooks of tile38_geofences.Tile38Geofences. The pool lives on a private event loop thread so synchronous callers (genData.py) can use it.
+class Tile38StatusResolver:
+    def __init__(self, url=TILE38_URL, collection='geofences', max_connections=8, chunk_size=500,
+                 timeout=2.0, inside_status='DISABLED', outside_status='ACTIVE', fallback_status='ACTIVE',
+                 fleet_collection=FLEET_COLLECTION):
+        self.url = url
+        self.collection = collection
+        self.fleet_collection = fleet_collection
+        self.max_connections = max_connections
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.inside_status = inside_status
+        self.outside_status = outside_status
+        self.fallback_status = fallback_status  # used for every point when Tile38 is slow or unreachable
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._redis = None
+
+    async def _on_connect(self, connection):
+        # Switch the connection to JSON replies, as pyle38 does
+        await connection.on_connect()
+        await connection.send_command('OUTPUT', 'json')
+        await connection.read_response()
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = Redis.from_url(
+                self.url,
+                protocol=2,
+                decode_responses=True,
+                max_connections=self.max_connections,
+                redis_connect_func=self._on_connect,
+            )
+        return self._redis
+
+    async def _count_chunk(self, points, slots):
+        pipe = self._client().pipeline(transaction=False)
+        for device_id, latitude, longitude in points:
+            if self.fleet_collection:
+                pipe.execute_command('SET', self.fleet_collection, device_id, 'POINT', latitude, longitude)
+            pipe.execute_command(
+                'INTERSECTS', self.collection, 'COUNT', 'BOUNDS',
+                latitude - POINT_MARGIN, longitude - POINT_MARGIN,
+                latitude + POINT_MARGIN, longitude + POINT_MARGIN,
+            )
+        async with slots:
+            return await pipe.execute(raise_on_error=False)
+
+    async def _resolve(self, points):
+        # At most max_connections pipelines in flight; the rest wait for a free connection
+        slots = asyncio.Semaphore(self.max_connections)
+        chunks = [points[i:i + self.chunk_size] for i in range(0, len(points), self.chunk_size)]
+        replies = [r for chunk in await asyncio.gather(*(self._count_chunk(chunk, slots) for chunk in chunks))
+                   for r in chunk]
+        if self.fleet_collection:
+            positions, replies = replies[0::2], replies[1::2]
+            failed = sum(1 for reply in positions if not _ok(reply))
+            if failed:
+                logging.warning(f"Tile38 position update failed for {failed} of {len(positions)} points")
+
+        statuses = []
+        for reply in replies:
+            response = _response(reply)
+            if not response or not response.get('ok'):
+                statuses.append(self.fallback_status)
+            elif response.get('count'):
+                statuses.append(self.inside_status)
+            else:
+                statuses.append(self.outside_status)
+        return statuses
+
+    # points: iterable of (device_id, latitude, longitude); returns one status per point, in order
+    def resolve_statuses(self, points):
+        points = list(points)
+        if not points:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._resolve(points), self._loop)
+        try:
+            return future.result(self.timeout)
+        except Exception as e:
+            future.cancel()
+            logging.warning(f"Tile38 status check failed for {len(points)} points, using fallback: {e!r}")
+            return [self.fallback_status] * len(points)
+
+    def close(self):
+        if self._redis is not None:
+            asyncio.run_coroutine_threadsafe(self._redis.aclose(), self._loop).result(self.timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,96 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Douglas-Peucker tolerance (in degrees) for a web-mercator zoom level: about one screen pixel
+def zoom_tolerance(zoom, tile_size=256):
+    return 360.0 / (tile_size * 2 ** zoom)
+
+
+# Douglas-Peucker simplification of a polyline given as coordinate arrays.
+# Returns (indices of the points kept, max distance of any dropped point from the simplified line),
+# the latter being the actual error bound of the result (always <= tolerance).
+def douglas_peucker(xs, ys, tolerance):
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    n = len(xs)
+    if n < 3:
+        return np.arange(n), 0.0
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    max_error = 0.0
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        seg_x = xs[first + 1:last] - xs[first]
+        seg_y = ys[first + 1:last] - ys[first]
+        dx, dy = xs[last] - xs[first], ys[last] - ys[first]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(seg_x, seg_y)
+        else:
+            distances = np.abs(dy * seg_x - dx * seg_y) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+        else:
+            max_error = max(max_error, float(distances[i]))
+    return np.nonzero(keep)[0], max_error
+
+
+# Google encoded polyline format (https://developers.google.com/maps/documentation/utilities/polylinealgorithm)
+def encode_polyline(lats, lons, precision=5):
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lon = 0
+    for lat, lon in zip(lats, lons):
+        lat_i, lon_i = int(round(lat * factor)), int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(chunks)
+
+
+# LRU cache of simplified path segments for closed time windows,
+# keyed by (device_id, window_start, tolerance)
+class SegmentCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Forget a device's segments, e.g. after its history was rewritten
+    def invalidate(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == device_id]:
+                    del self._entries[key]
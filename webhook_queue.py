@@ -0,0 +1,210 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+WEBHOOK_QUEUE_PATH = os.getenv('WEBHOOK_QUEUE_PATH', os.path.join('data', 'webhook_queue.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    geofence TEXT NOT NULL,
+    detect TEXT NOT NULL,
+    event_time TEXT NOT NULL DEFAULT '',
+    received_at REAL NOT NULL,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (device_id, geofence, detect, event_time)
+);
+CREATE INDEX IF NOT EXISTS events_claimed_at ON events (claimed_at, id);
+CREATE INDEX IF NOT EXISTS events_device_id ON events (device_id, claimed_at);
+"""
+
+
+# Durable local queue of geofence webhook events, kept in SQLite (WAL mode).
+#
+# put() is a single insert, so the webhook can return immediately. Tile38 redeliveries of an
+# event that is still pending are dropped by the unique key. claim() hands out the oldest
+# events in batches but skips devices that already have events in flight, so each device's
+# events are applied in order even with several workers. Claims that are not acked within
+# `visibility_timeout` (e.g. a worker died) become visible again.
+class WebhookQueue:
+    def __init__(self, path=WEBHOOK_QUEUE_PATH, visibility_timeout=60.0, max_attempts=5):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    # Returns False when the event is a duplicate of one still pending
+    def put(self, device_id, geofence, detect, event_time=''):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO events (device_id, geofence, detect, event_time, received_at) VALUES (?, ?, ?, ?, ?)",
+                (device_id, geofence, detect, event_time or '', time.time())
+            )
+            self._available.notify()
+            return cursor.rowcount == 1
+
+    # Claim up to `limit` events as [(id, device_id, geofence, detect)] in arrival order;
+    # waits up to `wait` seconds for events to arrive
+    def claim(self, limit=500, wait=1.0):
+        deadline = time.monotonic() + wait
+        with self._lock:
+            while True:
+                now = time.time()
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._conn.execute(
+                        "UPDATE events SET claimed_at = NULL WHERE claimed_at < ?", (now - self.visibility_timeout,)
+                    )
+                    rows = self._conn.execute("""
+                        SELECT id, device_id, geofence, detect FROM events
+                        WHERE claimed_at IS NULL
+                          AND device_id NOT IN (SELECT device_id FROM events WHERE claimed_at IS NOT NULL)
+                        ORDER BY id LIMIT ?
+                    """, (limit,)).fetchall()
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE events SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                            [(now, row[0]) for row in rows]
+                        )
+                    self._conn.execute('COMMIT')
+                except Exception:
+                    self._conn.execute('ROLLBACK')
+                    raise
+                remaining = deadline - time.monotonic()
+                if rows or remaining <= 0:
+                    return rows
+                self._available.wait(remaining)
+
+    # Remove processed events
+    def ack(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM events WHERE id = ?", [(i,) for i in ids])
+            self._available.notify_all()
+
+    # Make events claimable again; those that have failed max_attempts times are dropped
+    def release(self, ids):
+        with self._lock:
+            params = [(i,) for i in ids]
+            self._conn.executemany("UPDATE events SET claimed_at = NULL WHERE id = ?", params)
+            cursor = self._conn.execute(
+                f"DELETE FROM events WHERE attempts >= ? AND id IN ({','.join('?' * len(ids))})",
+                (self.max_attempts, *ids)
+            ) if ids else None
+            self._available.notify_all()
+            return cursor.rowcount if cursor else 0
+
+    def stats(self):
+        with self._lock:
+            pending, in_flight, oldest = self._conn.execute("""
+                SELECT
+                    coalesce(sum(claimed_at IS NULL), 0),
+                    coalesce(sum(claimed_at IS NOT NULL), 0),
+                    min(received_at)
+                FROM events
+            """).fetchone()
+        return {
+            'depth': pending + in_flight,
+            'pending': pending,
+            'in_flight': in_flight,
+            'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Worker threads draining a WebhookQueue in batches.
+#
+# `handler(events)` receives the claimed batch as [(device_id, geofence, detect)] collapsed to
+# the last event of each (device, geofence), ordered by that event's arrival, so the final state
+# it applies is the one Tile38 reported last; when it raises, the batch is released for a retry.
+class WebhookWorkerPool:
+    def __init__(self, queue, handler, workers=2, batch_size=500):
+        self.queue = queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.processed = 0
+        self.duplicates = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.workers = workers
+        self._counter_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    # Can be called again after stop(), e.g. when this process is re-elected as the consumer
+    def start(self):
+        if self._threads:
+            return self
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(self._stopped,), daemon=True)
+                         for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            try:
+                rows = self.queue.claim(self.batch_size)
+            except Exception as e:
+                logging.error(f"Webhook queue claim failed: {e}")
+                stopped.wait(1.0)
+                continue
+            if rows:
+                self._process(rows)
+
+    def _process(self, rows):
+        ids = [row[0] for row in rows]
+        latest = {}
+        for _, device_id, geofence, detect in sorted(rows):
+            latest.pop((device_id, geofence), None)  # re-insert so the order follows the last event
+            latest[(device_id, geofence)] = detect
+        events = [(device_id, geofence, detect) for (device_id, geofence), detect in latest.items()]
+        try:
+            self.handler(events)
+        except Exception as e:
+            logging.error(f"Webhook batch of {len(rows)} events failed, will retry: {e}")
+            dropped = self.queue.release(ids)
+            with self._counter_lock:
+                self.failed_batches += 1
+                self.dropped += dropped
+            return
+        self.queue.ack(ids)
+        with self._counter_lock:
+            self.processed += len(rows)
+            self.duplicates += len(rows) - len(events)
+            self.last_batch_size = len(rows)
+
+    def stats(self):
+        stats = self.queue.stats()
+        with self._counter_lock:
+            stats.update({
+                'processed': self.processed,
+                'duplicates': self.duplicates,
+                'failed_batches': self.failed_batches,
+                'dropped': self.dropped,
+                'last_batch_size': self.last_batch_size,
+                'workers': len(self._threads),
+                'consuming': bool(self._threads),
+            })
+        return stats